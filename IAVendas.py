@@ -1,29 +1,277 @@
 import sqlite3
 import time
+import os
+import io
+import bisect
+import functools
+import signal
+import csv
+import json
+import argparse
 import re
 from datetime import datetime, timedelta
 import hashlib
-from textblob import TextBlob
+import string
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import logging
+import logging.handlers
+import atexit
+import zlib
+import struct
 import random
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.action_chains import ActionChains
+import heapq
+import itertools
+import threading
+from abc import ABC, abstractmethod
+import queue
+import multiprocessing
+import multiprocessing.connection
 
-# Configuração de logging
-logging.basicConfig(filename='sales_bot.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# O Selenium é carregado só quando uma sessão do Chrome é aberta (ver _load_selenium):
+# exportar, importar e o modo simulado não pagam o custo da importação
+webdriver = By = Keys = WebDriverWait = EC = TimeoutException = None
+
+def _load_selenium():
+    global webdriver, By, Keys, WebDriverWait, EC, TimeoutException
+    if webdriver is None:
+        from selenium import webdriver
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException
+
+# Configuração de logging: o loop só enfileira os registros (QueueHandler) e uma thread
+# do QueueListener formata e grava no arquivo, com rotação por tamanho
+LOG_FILE = 'sales_bot.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_log_listener = None
+
+def setup_logging(path=LOG_FILE, level=logging.DEBUG, file_handler=None):
+    global _log_listener
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    
+    if file_handler is None:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                            encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _log_listener.start()
+
+def stop_logging():
+    # Esvazia a fila e fecha o arquivo; chamado na saída do processo
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+setup_logging()
+atexit.register(stop_logging)
+
+# Métricas de desempenho: histogramas de latência por etapa, contadores e medidores,
+# exportados periodicamente no formato texto do Prometheus (arquivo e/ou HTTP local)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRICS_FILE = 'sales_bot.prom'
+METRICS_EXPORT_INTERVAL = 30
+METRICS_PORT = None  # ex.: 9108 para servir /metrics em http://127.0.0.1:9108
+PROFILE_REQUEST_FILE = 'profile.request'
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._last_export = time.time()
+    
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+    
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if index < len(LATENCY_BUCKETS):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+    
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+    
+    def timed(self, stage):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.perf_counter() - started)
+            return wrapper
+        return decorator
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE salesbot_stage_seconds histogram')
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'salesbot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'salesbot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'salesbot_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+                lines.append(f'salesbot_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE salesbot_{name}_total counter')
+                lines.append(f'salesbot_{name}_total {value}')
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f'# TYPE salesbot_{name} gauge')
+                lines.append(f'salesbot_{name} {value}')
+        return '\n'.join(lines) + '\n'
+    
+    def write_file(self, path=None):
+        # Escrita atômica para o coletor nunca ler um arquivo pela metade
+        path = path or METRICS_FILE
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+    
+    def maybe_export(self, path=None):
+        if time.time() - self._last_export >= METRICS_EXPORT_INTERVAL:
+            self._last_export = time.time()
+            try:
+                self.write_file(path)
+            except OSError as e:
+                logging.error(f"Erro ao exportar métricas: {str(e)}")
+    
+    def serve(self, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Métricas disponíveis em http://127.0.0.1:{port}/metrics")
+        return server
+
+metrics = Metrics()
+
+# Perfilamento sob demanda: SIGUSR1 ou a criação do arquivo PROFILE_REQUEST_FILE
+# ativa o cProfile durante um único ciclo do loop principal
+_profile_requested = threading.Event()
+
+def request_profile(*_):
+    _profile_requested.set()
+
+if hasattr(signal, 'SIGUSR1'):
+    try:
+        signal.signal(signal.SIGUSR1, request_profile)
+    except ValueError:
+        pass  # importado fora da thread principal
+
+@contextmanager
+def profile_cycle():
+    requested = _profile_requested.is_set() or os.path.exists(PROFILE_REQUEST_FILE)
+    if not requested:
+        yield
+        return
+    _profile_requested.clear()
+    if os.path.exists(PROFILE_REQUEST_FILE):
+        os.remove(PROFILE_REQUEST_FILE)
+    
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = f'profile_{int(time.time())}.prof'
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+        logging.info(f"Perfil do ciclo salvo em {path}:\n{report.getvalue()}")
+        print(f"\n🔬 Perfil do ciclo salvo em {path}")
 
 def remove_non_bmp_chars(text):
     return ''.join(char for char in text if ord(char) <= 0xFFFF)
 
-def setup_database():
-    conn = sqlite3.connect('whatsapp_sales.db')
+def current_time():
+    # Data em texto (legível nos relatórios) e em segundos epoch (ordenável pelos índices)
+    now = datetime.now()
+    return now.strftime('%Y-%m-%d %H:%M:%S'), int(now.timestamp())
+
+DB_BUSY_TIMEOUT = 30  # segundos esperando o lock de escrita quando várias sessões usam o mesmo banco
+
+def connect_database(db_path='whatsapp_sales.db'):
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT)
     cursor = conn.cursor()
     
+    # WAL permite leituras concorrentes durante as escritas e commits mais baratos
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    
+    # Caches em memória valem para um único banco
+    invalidate_script_index()
+    follow_ups.reset()
+    _known_contacts.clear()
+    seen_messages.reset()
+    return conn, cursor
+
+def setup_database(db_path='whatsapp_sales.db'):
+    conn, cursor = connect_database(db_path)
+    migrate(conn)
+    invalidate_script_index()
+    return conn, cursor
+
+# Migrações versionadas (PRAGMA user_version): cada função leva o esquema da versão anterior
+# para a seguinte e roda uma única vez. Com o banco na versão atual, a inicialização não faz
+# nenhuma escrita. Bancos criados antes das migrações estão na versão 0, por isso os passos
+# iniciais toleram colunas e tabelas que já existam.
+def _add_column(cursor, table, column, column_def):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_def}')
+
+def _migrate_base_schema(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS contacts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -72,12 +320,86 @@ def setup_database():
         ('messages', 'context_summary', 'TEXT'),
         ('sales_scripts', 'tone', 'TEXT DEFAULT "profissional"')
     ]:
-        cursor.execute(f"PRAGMA table_info({table})")
-        if column not in [col[1] for col in cursor.fetchall()]:
-            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_def}')
+        _add_column(cursor, table, column, column_def)
+
+def _migrate_epoch_timestamps(cursor):
+    _add_column(cursor, 'contacts', 'last_interaction_ts', 'INTEGER')
+    _add_column(cursor, 'contacts', 'last_follow_up_ts', 'INTEGER')
     
-    # Limpar scripts antigos
-    cursor.execute('DELETE FROM sales_scripts')
+    # Preenche os timestamps em segundos (epoch) a partir das datas em texto (hora local)
+    cursor.execute('''
+        UPDATE contacts SET last_interaction_ts = CAST(strftime('%s', last_interaction, 'utc') AS INTEGER)
+        WHERE last_interaction_ts IS NULL AND last_interaction IS NOT NULL
+    ''')
+    cursor.execute('''
+        UPDATE contacts SET last_follow_up_ts = CAST(strftime('%s', last_follow_up, 'utc') AS INTEGER)
+        WHERE last_follow_up_ts IS NULL AND last_follow_up IS NOT NULL
+    ''')
+
+def _migrate_message_ids(cursor):
+    _add_column(cursor, 'messages', 'wa_id', 'TEXT')
+    # A deduplicação por hash do texto descartava mensagens repetidas ("ok", "ok"); agora vale o id do WhatsApp
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_contact_hash')
+
+def _migrate_indexes_and_analytics(cursor):
+    create_indexes(cursor)
+    setup_analytics(cursor)
+
+def _migrate_message_search(cursor):
+    # context_summary era gravado a cada mensagem e nunca lido
+    try:
+        cursor.execute('ALTER TABLE messages DROP COLUMN context_summary')
+    except sqlite3.OperationalError:
+        pass  # SQLite anterior à 3.35 ou coluna já removida
+    try:
+        for statement in MESSAGE_SEARCH_SCHEMA:
+            cursor.execute(statement)
+    except sqlite3.OperationalError as e:
+        # SQLite sem FTS5: a busca cai para uma varredura com LIKE
+        logging.warning(f"Índice de busca de mensagens indisponível: {str(e)}")
+        return
+    cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def _migrate_rescore_checkpoint(cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS rescore_checkpoint (id INTEGER PRIMARY KEY CHECK (id = 1), last_contact_id INTEGER NOT NULL)')
+
+def _migrate_archived_ids(cursor):
+    # Ids do WhatsApp das mensagens arquivadas: continuam deduplicando depois que a linha sai de messages
+    cursor.execute('''CREATE TABLE IF NOT EXISTS archived_wa_ids (contact_id INTEGER NOT NULL, wa_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL, PRIMARY KEY (contact_id, wa_id)) WITHOUT ROWID''')
+
+def _migrate_floor_score_buckets(cursor):
+    # Triggers antigos dividiam com truncamento: scores negativos caíam na faixa 0 a 9
+    for trigger in ('trg_contacts_analytics_insert', 'trg_contacts_analytics_delete', 'trg_contacts_analytics_score'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    for statement in ANALYTICS_SCHEMA:
+        cursor.execute(statement)
+    cursor.execute('DELETE FROM lead_score_buckets')
+    _fill_score_buckets(cursor)
+    cursor.execute('UPDATE analytics_state SET version = version + 1')
+
+def _migrate_prune_archived_ids(cursor):
+    # Só os últimos SEEN_WINDOW ids arquivados de cada contato podem ser relidos pelo observer
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_archived_wa_ids_message ON archived_wa_ids(message_id)')
+    cursor.execute('SELECT DISTINCT contact_id FROM archived_wa_ids')
+    prune_archived_ids(cursor, [row[0] for row in cursor.fetchall()])
+
+def _migrate_follow_up_index(cursor):
+    # O índice antigo deixou de servir à carga da fila de follow-ups depois do filtro de opt-out
+    cursor.execute('DROP INDEX IF EXISTS idx_contacts_follow_up')
+    create_indexes(cursor)
+
+def _migrate_clamp_script_successes(cursor):
+    # Versões antigas creditavam sucesso sem contar o uso (ou antes de um envio que falhou):
+    # success_count acima de use_count daria taxas acima de 100%. Os triggers ajustam script_stage_stats.
+    cursor.execute('UPDATE sales_scripts SET success_count = use_count WHERE success_count > use_count')
+
+def _migrate_default_scripts(cursor):
+    # Os scripts padrão só entram em um banco sem scripts: success_count aprendido e os
+    # scripts criados com train_ai sobrevivem às reinicializações
+    cursor.execute('SELECT 1 FROM sales_scripts LIMIT 1')
+    if cursor.fetchone():
+        return
     
     cursor.executemany('''
         INSERT INTO sales_scripts (stage, keyword, response, tone) VALUES (?, ?, ?, ?)
@@ -91,9 +413,94 @@ def setup_database():
         ('fechamento', 'quero|comprar', 'Show, {contact_name}! 🚀 Vamos garantir seu {product} agora? Temos uma oferta especial hoje: 20% de desconto! Qual o melhor jeito de te enviar o link? 💼', 'profissional'),
         ('follow-up', 'silêncio', 'Oi, {contact_name}! Tudo certo? Lembrei de você porque nosso {product} é ideal para {pain_point}. Outros no {industry} estão vendo resultados. Quer conversar? 🌟', 'profissional')
     ])
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_epoch_timestamps,
+    _migrate_message_ids,
+    _migrate_indexes_and_analytics,
+    _migrate_default_scripts,
+    _migrate_message_search,
+    _migrate_rescore_checkpoint,
+    _migrate_archived_ids,
+    _migrate_floor_score_buckets,
+    _migrate_prune_archived_ids,
+    _migrate_follow_up_index,
+    _migrate_clamp_script_successes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA user_version')
+    if cursor.fetchone()[0] >= SCHEMA_VERSION:
+        return False
     
-    conn.commit()
-    return conn, cursor
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Outra sessão pode ter migrado o banco enquanto esperávamos o lock
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            logging.info(f"Banco migrado para a versão {number} ({migration.__name__})")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+# Índices do caminho crítico: busca de contato por nome, deduplicação por id do WhatsApp, histórico por contato
+# carga da fila de follow-ups e ranking dos melhores leads
+INDEXES = [
+    ('idx_contacts_name', 'contacts(name)', True),
+    ('idx_messages_wa_id', 'messages(contact_id, wa_id)', True),
+    ('idx_messages_contact', 'messages(contact_id)', False),
+    # Parcial, com o mesmo filtro de FollowUpScheduler.load: a carga lê só o índice, e contatos
+    # importados que nunca receberam mensagem não pagam a manutenção dele
+    ('idx_contacts_follow_up_due', "contacts(last_interaction_ts, last_follow_up_ts, initial_message_sent, current_stage) "
+                                   "WHERE initial_message_sent = 1 AND current_stage IS NOT 'opt-out'", False),
+    ('idx_contacts_lead_score', 'contacts(lead_score DESC)', False),
+]
+
+def create_indexes(cursor):
+    for name, columns, unique in INDEXES:
+        try:
+            cursor.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON {columns}')
+        except sqlite3.IntegrityError as e:
+            # Banco antigo com duplicatas: mantém um índice comum para não perder dados
+            logging.warning(f"Não foi possível criar o índice único {name}: {str(e)}. Usando índice comum.")
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {columns}')
+
+# Escritas agrupadas: dentro de write_batch os commits são adiados até o fim do bloco
+_write_batches = {}
+
+@contextmanager
+def write_batch(conn):
+    # O bloco mais externo confirma tudo se terminar bem e desfaz tudo se levantar exceção
+    key = id(conn)
+    _write_batches[key] = _write_batches.get(key, 0) + 1
+    try:
+        yield
+    except BaseException:
+        if _leave_batch(key):
+            conn.rollback()
+        raise
+    if _leave_batch(key):
+        conn.commit()
+
+def _leave_batch(key):
+    # True ao sair do bloco mais externo
+    _write_batches[key] -= 1
+    if _write_batches[key]:
+        return False
+    del _write_batches[key]
+    return True
+
+def commit(conn):
+    if id(conn) not in _write_batches:
+        conn.commit()
 
 def detect_user_tone(message):
     message_lower = message.lower()
@@ -103,101 +510,298 @@ def detect_user_tone(message):
         return 'formal'
     return 'profissional'
 
+# Regras de palavras-chave avaliadas antes do TextBlob (a primeira que casar decide)
+SENTIMENT_RULES = [
+    (re.compile(r'\b(quero|comprar|interessado|show|legal|ótimo|valeu|adoraria)\b'), "Positivo"),
+    (re.compile(r'\b(não|caro|pare|stop|desinteressado)\b'), "Negativo"),
+    (re.compile(r'\b(saber|explicar|como|qual|detalhes|mostrar|me explique)\b'), "Curioso"),
+]
+SENTIMENT_CACHE_SIZE = 4096
+
+_sentiment_cache = OrderedDict()
+_sentiment_stats = {'hits': 0, 'misses': 0}
+_TextBlob = None
+
+def _get_textblob():
+    # Importação tardia: o textblob só é carregado quando nenhuma regra decide
+    global _TextBlob
+    if _TextBlob is None:
+        from textblob import TextBlob
+        _TextBlob = TextBlob
+    return _TextBlob
+
+def _compute_sentiment(message):
+    message_lower = message.lower()
+    for pattern, sentiment in SENTIMENT_RULES:
+        if pattern.search(message_lower):
+            return sentiment
+    
+    polarity = _get_textblob()(message).sentiment.polarity
+    if polarity > 0.3:
+        return "Positivo"
+    elif polarity < -0.3:
+        return "Negativo"
+    elif 0.1 < polarity <= 0.3:
+        return "Curioso"
+    elif -0.3 <= polarity < -0.1:
+        return "Hesitante"
+    return "Neutro"
+
+@metrics.timed('analyze_sentiment')
 def analyze_sentiment(message):
+    key = hashlib.sha256(message.encode()).digest()
+    sentiment = _sentiment_cache.get(key)
+    if sentiment is not None:
+        _sentiment_cache.move_to_end(key)
+        _sentiment_stats['hits'] += 1
+        return sentiment
+    
+    _sentiment_stats['misses'] += 1
     try:
-        blob = TextBlob(message)
-        polarity = blob.sentiment.polarity
-        message_lower = message.lower()
-        
-        if re.search(r'\b(quero|comprar|interessado|show|legal|ótimo|valeu|adoraria)\b', message_lower):
-            return "Positivo"
-        if re.search(r'\b(não|caro|pare|stop|desinteressado)\b', message_lower):
-            return "Negativo"
-        if re.search(r'\b(saber|explicar|como|qual|detalhes|mostrar|me explique)\b', message_lower):
-            return "Curioso"
-        
-        if polarity > 0.3:
-            return "Positivo"
-        elif polarity < -0.3:
-            return "Negativo"
-        elif 0.1 < polarity <= 0.3:
-            return "Curioso"
-        elif -0.3 <= polarity < -0.1:
-            return "Hesitante"
-        return "Neutro"
+        sentiment = _compute_sentiment(message)
     except Exception as e:
         logging.error(f"Erro na análise de sentimento: {str(e)}")
         return "Neutro"
+    
+    _sentiment_cache[key] = sentiment
+    if len(_sentiment_cache) > SENTIMENT_CACHE_SIZE:
+        _sentiment_cache.popitem(last=False)
+    return sentiment
 
-def summarize_context(cursor, contact_id):
-    cursor.execute('SELECT message, sender FROM messages WHERE contact_id = ? ORDER BY timestamp DESC LIMIT 10', 
-                  (contact_id,))
-    messages = cursor.fetchall()
-    summary = "Conversa recente: "
-    for msg, sender in messages:
-        summary += f"{sender}: {msg[:50]}... "
-    return summary[:200]
+def analyze_sentiment_batch(messages):
+    # Mensagens repetidas no lote são avaliadas uma única vez
+    results = {}
+    for message in messages:
+        if message not in results:
+            results[message] = analyze_sentiment(message)
+    return [results[message] for message in messages]
+
+def sentiment_cache_info():
+    return {**_sentiment_stats, 'size': len(_sentiment_cache), 'max_size': SENTIMENT_CACHE_SIZE}
+
+def clear_sentiment_cache():
+    _sentiment_cache.clear()
+    _sentiment_stats['hits'] = _sentiment_stats['misses'] = 0
+
+# Cache nome -> (id, indústria, ponto de dor): o refresh de contatos só grava quando algo mudou
+_known_contacts = {}
 
 def update_contact(cursor, conn, name, industry=None, pain_point=None):
-    cursor.execute('SELECT id, engagement_level, current_stage FROM contacts WHERE name = ?', (name,))
-    contact = cursor.fetchone()
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    known = _known_contacts.get(name)
+    if known is None:
+        cursor.execute('SELECT id, industry, pain_point FROM contacts WHERE name = ?', (name,))
+        known = cursor.fetchone()
     
-    if not contact:
+    if not known:
+        now, now_ts = current_time()
         cursor.execute('''
-            INSERT INTO contacts (name, last_interaction, lead_score, initial_message_sent, industry, pain_point, engagement_level, current_stage)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (name, now, 50, 0, industry, pain_point, 'neutro', 'prospecção'))
-        conn.commit()
-        return cursor.lastrowid
+            INSERT INTO contacts (name, last_interaction, last_interaction_ts, lead_score, initial_message_sent, industry, pain_point, engagement_level, current_stage)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (name, now, now_ts, 50, 0, industry, pain_point, 'neutro', 'prospecção'))
+        commit(conn)
+        contact_id = cursor.lastrowid
     else:
-        engagement, current_stage = contact[1], contact[2]
-        cursor.execute('UPDATE contacts SET last_interaction = ?, industry = ?, pain_point = ? WHERE name = ?',
-                       (now, industry, pain_point, name))
-        conn.commit()
-        return contact[0]
+        contact_id = known[0]
+        if (known[1], known[2]) != (industry, pain_point):
+            cursor.execute('UPDATE contacts SET industry = ?, pain_point = ? WHERE id = ?',
+                           (industry, pain_point, contact_id))
+            commit(conn)
+    _known_contacts[name] = (contact_id, industry, pain_point)
+    return contact_id
+
+def mark_initial_message_sent(cursor, contact_id):
+    now, now_ts = current_time()
+    cursor.execute('UPDATE contacts SET initial_message_sent = 1, last_interaction = ?, last_interaction_ts = ? WHERE id = ?',
+                   (now, now_ts, contact_id))
+    follow_ups.touch(contact_id, last_interaction_ts=now_ts)
+
+# Mensagens recebidas já processadas, por id do WhatsApp: checagem O(1) sem ida ao banco.
+# Cada contato guarda os SEEN_WINDOW ids mais recentes; um id mais antigo que reapareça
+# é barrado pelo índice único (contact_id, wa_id) no INSERT OR IGNORE de log_message.
+SEEN_WINDOW = 256
+SEEN_WARMUP_ROWS = 100_000
 
-def log_message(cursor, conn, contact_id, message, sender, sentiment):
-    message_hash = hashlib.sha256(message.encode()).hexdigest()
-    context_summary = summarize_context(cursor, contact_id)
+class SeenMessages:
+    def __init__(self, window=SEEN_WINDOW):
+        self.window = window
+        self.reset()
     
-    cursor.execute('SELECT id FROM messages WHERE contact_id = ? AND message_hash = ?', (contact_id, message_hash))
-    if not cursor.fetchone():
-        cursor.execute('''
-            INSERT INTO messages (contact_id, message, message_hash, sender, timestamp, sentiment, context_summary)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (contact_id, message, message_hash, sender, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sentiment, context_summary))
-        conn.commit()
+    def reset(self):
+        self.loaded = False
+        self._ids = {}
+    
+    def load(self, cursor, limit=SEEN_WARMUP_ROWS):
+        self.reset()
+        # Primeiro os ids arquivados (mais antigos), depois os do banco principal: numa conversa parada
+        # há meses, as últimas mensagens que o observer relê podem estar só no arquivo
+        cursor.execute('SELECT contact_id, wa_id FROM archived_wa_ids ORDER BY message_id DESC LIMIT ?', (limit,))
+        archived = cursor.fetchall()
+        cursor.execute('SELECT contact_id, wa_id FROM messages WHERE wa_id IS NOT NULL ORDER BY id DESC LIMIT ?', (limit,))
+        for contact_id, wa_id in itertools.chain(reversed(archived), reversed(cursor.fetchall())):
+            self.add(contact_id, wa_id)
+        self.loaded = True
+        logging.info(f"Índice de mensagens vistas carregado com {len(self)} ids")
+    
+    def add(self, contact_id, wa_id):
+        entry = self._ids.get(contact_id)
+        if entry is None:
+            entry = self._ids[contact_id] = (set(), deque())
+        ids, order = entry
+        if wa_id in ids:
+            return
+        ids.add(wa_id)
+        order.append(wa_id)
+        if len(order) > self.window:
+            ids.discard(order.popleft())
+    
+    def discard(self, contact_id, wa_id):
+        # Desfaz um add cuja gravação foi revertida
+        entry = self._ids.get(contact_id)
+        if entry is not None and wa_id in entry[0]:
+            entry[0].discard(wa_id)
+            entry[1].remove(wa_id)
+    
+    def seen(self, contact_id, wa_id):
+        entry = self._ids.get(contact_id)
+        return entry is not None and wa_id in entry[0]
+    
+    def __len__(self):
+        return sum(len(ids) for ids, _ in self._ids.values())
+
+seen_messages = SeenMessages()
+
+def prune_archived_ids(cursor, contact_ids, keep=SEEN_WINDOW):
+    # archived_wa_ids fica no banco principal: mantém por contato só os ids mais recentes
+    cursor.executemany('''
+        DELETE FROM archived_wa_ids WHERE contact_id = ? AND message_id <= (
+            SELECT message_id FROM archived_wa_ids WHERE contact_id = ? ORDER BY message_id DESC LIMIT 1 OFFSET ?)
+    ''', ((contact_id, contact_id, keep) for contact_id in contact_ids))
+
+def message_key(item):
+    # Sem o id do WhatsApp (leitura por XPath sem data-id), cai no hash do texto como antes
+    return item.get('id') or 'sha256:' + hashlib.sha256(item['text'].encode()).hexdigest()
+
+@metrics.timed('log_message')
+def log_message(cursor, conn, contact_id, message, sender, sentiment, wa_id=None):
+    # Só mensagens com wa_id são deduplicadas; as do bot (wa_id NULL) sempre entram.
+    if wa_id is not None:
+        cursor.execute('SELECT 1 FROM archived_wa_ids WHERE contact_id = ? AND wa_id = ?', (contact_id, wa_id))
+        if cursor.fetchone():
+            seen_messages.add(contact_id, wa_id)
+            return False
+    cursor.execute('''
+        INSERT OR IGNORE INTO messages (contact_id, message, wa_id, sender, timestamp, sentiment)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (contact_id, message, wa_id, sender, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sentiment))
+    inserted = cursor.rowcount == 1
+    if wa_id is not None:
+        seen_messages.add(contact_id, wa_id)
+    commit(conn)
+    return inserted
+
+# Índice de scripts em memória: (estágio, tom do usuário) -> padrão único pré-compilado
+_script_index = None
+_template_formatter = string.Formatter()
+USER_TONES = ('profissional', 'descontraído', 'formal')
 
+def _parse_template(response):
+    # Pré-processa o template de resposta em pedaços (literal, campo, formato)
+    parts = []
+    for literal, field, spec, conversion in _template_formatter.parse(response):
+        if field is not None and (conversion or not field.isidentifier() or '{' in (spec or '')):
+            return None
+        parts.append((literal, field, spec))
+    return parts
+
+def _render_template(script, values):
+    if script['template'] is None:
+        return script['response'].format(**values)
+    rendered = []
+    for literal, field, spec in script['template']:
+        rendered.append(literal)
+        if field is not None:
+            rendered.append(format(values[field], spec))
+    return ''.join(rendered)
+
+def build_script_index(cursor):
+    cursor.execute('SELECT id, stage, keyword, response, tone FROM sales_scripts ORDER BY id')
+    scripts_by_stage = {}
+    for script_id, stage, keyword, response, tone in cursor.fetchall():
+        group = f's{script_id}'
+        branch = rf'(?=(?s:.*?)(?P<{group}>\b{keyword}\b))'
+        try:
+            re.compile(branch)
+        except re.error as e:
+            logging.error(f"Palavra-chave inválida no script {script_id} ({keyword}): {str(e)}")
+            continue
+        try:
+            template = _parse_template(response)
+        except ValueError as e:
+            logging.error(f"Template inválido no script {script_id}: {str(e)}")
+            continue
+        scripts_by_stage.setdefault(stage, []).append({
+            'id': script_id, 'group': group, 'branch': branch, 'tone': tone,
+            'response': response, 'template': template
+        })
+
+    # Uma alternação por (estágio, tom): cada ramo é um lookahead ancorado no início,
+    # então o primeiro script (em ordem de id) que casar vence, como na busca linha a linha
+    index = {}
+    for stage, scripts in scripts_by_stage.items():
+        for user_tone in USER_TONES:
+            eligible = [s for s in scripts if s['tone'] in (user_tone, 'profissional')]
+            if eligible:
+                pattern = re.compile('^(?:' + '|'.join(s['branch'] for s in eligible) + ')')
+                index[(stage, user_tone)] = (pattern, {s['group']: s for s in eligible})
+    logging.info(f"Índice de scripts carregado: {len(index)} combinações de estágio/tom")
+    return index
+
+def invalidate_script_index():
+    global _script_index
+    _script_index = None
+
+def _get_script_index(cursor):
+    global _script_index
+    if _script_index is None:
+        _script_index = build_script_index(cursor)
+    return _script_index
+
+@metrics.timed('get_sales_script')
 def get_sales_script(cursor, message, stage, contact_id, contact_name, product, pain_point=None, industry=None):
     message_lower = message.lower()
     user_tone = detect_user_tone(message)
     
-    cursor.execute('SELECT response, id, keyword, tone FROM sales_scripts WHERE stage = ?', (stage,))
-    scripts = cursor.fetchall()
-    
-    for response, script_id, keyword, tone in scripts:
-        if re.search(rf'\b{keyword}\b', message_lower) and tone in (user_tone, 'profissional'):
+    entry = _get_script_index(cursor).get((stage, user_tone))
+    if entry:
+        pattern, scripts = entry
+        match = pattern.search(message_lower)
+        if match:
+            script = scripts[match.lastgroup]
             benefit = f"técnicas para superar {pain_point}" if pain_point else "resultados rápidos"
             pain_point = pain_point or "seus desafios"
             industry = industry or "seu setor"
             
-            formatted_response = response.format(
-                contact_name=contact_name, 
-                product=product, 
-                benefit=benefit, 
-                pain_point=pain_point, 
-                industry=industry
-            )
-            return formatted_response, script_id
+            formatted_response = _render_template(script, {
+                'contact_name': contact_name, 
+                'product': product, 
+                'benefit': benefit, 
+                'pain_point': pain_point, 
+                'industry': industry
+            })
+            return formatted_response, script['id']
     
     default_response = f"Entendi, {contact_name}! Parece que você está interessado em resolver {pain_point or 'seus desafios'} no {industry or 'seu setor'}. Nosso {product} tem estratégias específicas para isso. Quer que eu explique mais ou envie um trecho grátis? 😊"
     return default_response, None
 
+def mark_script_used(cursor, conn, script_id):
+    if script_id:
+        cursor.execute('UPDATE sales_scripts SET use_count = use_count + 1 WHERE id = ?', (script_id,))
+        commit(conn)
+
 def mark_script_success(cursor, conn, script_id):
     if script_id:
         cursor.execute('UPDATE sales_scripts SET success_count = success_count + 1 WHERE id = ?', (script_id,))
-        conn.commit()
+        commit(conn)
 
 def train_ai(cursor, conn):
     print("\nModo de Treinamento da IA")
@@ -208,232 +812,2162 @@ def train_ai(cursor, conn):
     
     cursor.execute('INSERT INTO sales_scripts (stage, keyword, response, tone) VALUES (?, ?, ?, ?)', 
                    (stage, keyword, response, tone))
-    conn.commit()
+    commit(conn)
+    invalidate_script_index()
     print("Treinamento salvo com sucesso!")
 
-def check_follow_ups(cursor, conn, driver, product):
-    now = datetime.now()
-    cursor.execute('''
-        SELECT id, name, last_interaction, pain_point, industry
-        FROM contacts
-        WHERE last_follow_up IS NULL OR last_follow_up < ?
-    ''', ((now - timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S'),))
-    
-    for contact_id, name, last_interaction, pain_point, industry in cursor.fetchall():
-        last_interaction_time = datetime.strptime(last_interaction, '%Y-%m-%d %H:%M:%S')
-        if now - last_interaction_time > timedelta(hours=48):
-            response, script_id = get_sales_script(cursor, 'silêncio', 'follow-up', contact_id, name, product, pain_point, industry)
+# Follow-up: contato que já recebeu a mensagem inicial, em silêncio há 48h e sem follow-up nos últimos 2 dias
+FOLLOW_UP_SILENCE = 48 * 3600
+FOLLOW_UP_INTERVAL = 2 * 24 * 3600
+
+def follow_up_due_time(last_interaction_ts, last_follow_up_ts):
+    # Sem data de interação não há como medir o silêncio: o contato não entra na fila
+    if last_interaction_ts is None:
+        return None
+    due = last_interaction_ts + FOLLOW_UP_SILENCE
+    if last_follow_up_ts:
+        due = max(due, last_follow_up_ts + FOLLOW_UP_INTERVAL)
+    return due
+
+class FollowUpScheduler:
+    # Min-heap de (vencimento, contato); entradas antigas são descartadas ao sair do heap
+    def __init__(self):
+        self.shard = None  # ids atendidos por esta sessão (run_bot); None = todos
+        self.reset()
+    
+    def reset(self):
+        self.loaded = False
+        self._heap = []
+        self._state = {}
+    
+    def load(self, cursor):
+        self.reset()
+        # Quem pediu para parar, ou nunca recebeu a mensagem inicial, não recebe follow-up
+        cursor.execute("""SELECT id, last_interaction_ts, last_follow_up_ts FROM contacts
+                          WHERE initial_message_sent = 1 AND current_stage IS NOT 'opt-out'""")
+        for contact_id, last_interaction_ts, last_follow_up_ts in cursor.fetchall():
+            if self.shard is None or contact_id in self.shard:
+                self._schedule(contact_id, last_interaction_ts, last_follow_up_ts)
+        heapq.heapify(self._heap)
+        self.loaded = True
+        logging.info(f"Fila de follow-ups carregada com {len(self._state)} contatos")
+    
+    def _schedule(self, contact_id, last_interaction_ts, last_follow_up_ts):
+        due = follow_up_due_time(last_interaction_ts, last_follow_up_ts)
+        if due is None:
+            return
+        self._state[contact_id] = (last_interaction_ts, last_follow_up_ts, due)
+        self._heap.append((due, contact_id))
+    
+    def touch(self, contact_id, last_interaction_ts=None, last_follow_up_ts=None):
+        # Antes da carga não há nada a atualizar: load() lerá o valor novo do banco
+        if not self.loaded or (self.shard is not None and contact_id not in self.shard):
+            return
+        previous = self._state.get(contact_id, (None, None, None))
+        last_interaction_ts = last_interaction_ts if last_interaction_ts is not None else previous[0]
+        last_follow_up_ts = last_follow_up_ts if last_follow_up_ts is not None else previous[1]
+        due = follow_up_due_time(last_interaction_ts, last_follow_up_ts)
+        if due is None:
+            self._state.pop(contact_id, None)
+            return
+        self._state[contact_id] = (last_interaction_ts, last_follow_up_ts, due)
+        heapq.heappush(self._heap, (due, contact_id))
+        # Compacta o heap quando as entradas desatualizadas passam a dominar
+        if len(self._heap) > 2 * len(self._state) + 1000:
+            self._heap = [(state[2], cid) for cid, state in self._state.items()]
+            heapq.heapify(self._heap)
+    
+    def remove(self, contact_id):
+        # As entradas do heap ficam órfãs e são descartadas em pop_due
+        self._state.pop(contact_id, None)
+    
+    def pop_due(self, now_ts):
+        due_contacts = {}
+        while self._heap and self._heap[0][0] <= now_ts:
+            due, contact_id = heapq.heappop(self._heap)
+            state = self._state.get(contact_id)
+            if state and state[2] == due:
+                due_contacts[contact_id] = due
+        return list(due_contacts)
+    
+    def __len__(self):
+        return len(self._state)
+
+follow_ups = FollowUpScheduler()
+
+@metrics.timed('check_follow_ups')
+def check_follow_ups(cursor, conn, transport, product):
+    if not follow_ups.loaded:
+        follow_ups.load(cursor)
+    now, now_ts = current_time()
+    
+    for contact_id in follow_ups.pop_due(now_ts):
+        cursor.execute("""SELECT name, pain_point, industry FROM contacts
+                          WHERE id = ? AND initial_message_sent = 1 AND current_stage IS NOT 'opt-out'""", (contact_id,))
+        contact = cursor.fetchone()
+        if not contact:
+            continue
+        name, pain_point, industry = contact
+        response, script_id = get_sales_script(cursor, 'silêncio', 'follow-up', contact_id, name, product, pain_point, industry)
+        if response:
+            queue_message(transport, cursor, conn, contact_id, name, response,
+                          on_sent=_mark_used_on_send(cursor, conn, script_id))
+            with write_batch(conn):
+                cursor.execute('UPDATE contacts SET last_follow_up = ?, last_follow_up_ts = ? WHERE id = ?',
+                               (now, now_ts, contact_id))
+            follow_ups.touch(contact_id, last_follow_up_ts=now_ts)
+
+# Transições de estado do contato a cada mensagem recebida (também usadas pela re-pontuação)
+OPT_OUT_PATTERN = re.compile(r'\b(não|pare|stop|desinteressado)\b')
+LEAD_SCORE_DELTAS = {'Positivo': 15, 'Curioso': 15, 'Negativo': -10}
+
+def classify_engagement(sentiment):
+    # (engagement_level, current_stage) depois de uma mensagem com este sentimento
+    if sentiment in ('Positivo', 'Curioso'):
+        return 'positivo', 'nurturing'
+    if sentiment == 'Negativo':
+        return 'negativo', 'objeção'
+    return 'neutro', 'prospecção'
+
+def process_incoming_message(transport, cursor, conn, contact_id, contact_name, product, clean_msg, pain_point=None, industry=None, wa_id=None):
+    # Uma transação por mensagem recebida; os envios só entram na fila depois do commit, então o
+    # banco nunca fica travado esperando o navegador (várias sessões usam o mesmo arquivo)
+    replies = []
+    opted_out = False
+    try:
+        with write_batch(conn):
+            sentiment = analyze_sentiment(clean_msg)
+            if not log_message(cursor, conn, contact_id, clean_msg, 'user', sentiment, wa_id):
+                return 'duplicada'
+            
+            engagement, new_stage = classify_engagement(sentiment)
+            
+            now, now_ts = current_time()
+            cursor.execute('UPDATE contacts SET engagement_level = ?, current_stage = ?, last_interaction = ?, last_interaction_ts = ?, initial_message_sent = 1 WHERE id = ?', 
+                           (engagement, new_stage, now, now_ts, contact_id))
+            
+            response, script_id = get_sales_script(cursor, clean_msg, new_stage, contact_id, contact_name, product, pain_point, industry)
             if response:
-                send_message(driver, cursor, conn, contact_id, name, response)
-                cursor.execute('UPDATE contacts SET last_follow_up = ? WHERE id = ?',
-                               (now.strftime('%Y-%m-%d %H:%M:%S'), contact_id))
-                conn.commit()
+                # Uso e sucesso do script só contam quando a resposta é de fato enviada
+                replies.append((response, _mark_used_on_send(cursor, conn, script_id, success=sentiment in ["Positivo", "Curioso"]),
+                                'reply_delay'))
+                cursor.execute('UPDATE contacts SET lead_score = lead_score + ? WHERE id = ?', 
+                               (LEAD_SCORE_DELTAS.get(sentiment, 0), contact_id))
+            
+            if OPT_OUT_PATTERN.search(clean_msg.lower()):
+                opted_out = True
+                replies.append((f"Entendido, {contact_name}. Respeito sua decisão. Caso queira conversar no futuro, é só me chamar! 😊",
+                                None, None))
+                cursor.execute('UPDATE contacts SET lead_score = 0, engagement_level = "negativo", current_stage = "opt-out" WHERE id = ?', 
+                               (contact_id,))
+    except Exception:
+        # Transação desfeita: a mensagem volta a ser nova na próxima leitura
+        if wa_id is not None:
+            seen_messages.discard(contact_id, wa_id)
+        raise
+    
+    metrics.inc('messages_in')
+    print(f"\nNova mensagem de {contact_name}: {clean_msg} (Sentimento: {sentiment})")
+    logging.info(f"Nova mensagem de {contact_name}: {clean_msg} (Sentimento: {sentiment})")
+    if opted_out:
+        follow_ups.remove(contact_id)
+    else:
+        follow_ups.touch(contact_id, last_interaction_ts=now_ts)
+    
+    # A resposta entra na fila de saída: a leitura segue enquanto ela é digitada
+    for message, on_sent, delay_key in replies:
+        queue_message(transport, cursor, conn, contact_id, contact_name, message,
+                      on_sent=on_sent, delay_key=delay_key, reply=True)
+    return 'opt-out' if opted_out else 'processada'
 
-def read_messages(driver, cursor, conn, contact_id, contact_name, product, pain_point=None, industry=None):
+MESSAGE_WATCH_TIMEOUT = 120
+
+@metrics.timed('read_messages')
+def read_messages(transport, cursor, conn, contact_id, contact_name, product, pain_point=None, industry=None, timeout=MESSAGE_WATCH_TIMEOUT):
     try:
-        # Aguardar a lista de conversas
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.XPATH, '//div[@aria-label="Lista de conversas"]'))
-        )
-        
         # Tentar abrir a conversa do contato
-        try:
-            contact_element = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
-            )
-            contact_element.click()
-            time.sleep(7)
-        except:
+        with metrics.timer('open_chat'):
+            chat_found = transport.open_chat(contact_name)
+        if not chat_found:
             logging.warning(f"Conversa com {contact_name} não encontrada. Iniciando nova conversa.")
             response, script_id = get_sales_script(cursor, 'oi', 'prospecção', contact_id, contact_name, product, pain_point, industry)
-            if send_message(driver, cursor, conn, contact_id, contact_name, response):
-                cursor.execute('UPDATE contacts SET initial_message_sent = 1, last_interaction = ? WHERE id = ?',
-                               (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), contact_id))
-                conn.commit()
+            if not outbox.has_pending(contact_id):
+                queue_message(transport, cursor, conn, contact_id, contact_name, response,
+                              on_sent=_mark_initial_on_send(cursor, conn, contact_id, script_id))
             return False
-
-        # Monitorar mensagens novas por até 120 segundos
+        
+        # Monitorar mensagens novas por até `timeout` segundos
         start_time = time.time()
-        timeout = 120
         new_messages = False
         
         while time.time() - start_time < timeout:
+            outbox.apply_results(cursor, conn)
             try:
-                # Rolar para o final da conversa
-                message_pane = driver.find_element(By.XPATH, '//div[@id="main"]')
-                driver.execute_script("arguments[0].scrollTop = arguments[0].scrollHeight", message_pane)
-                time.sleep(7)
-                logging.info(f"Verificando mensagens para {contact_name}")
-
-                # Tentar diferentes XPaths para mensagens recebidas
-                xpaths = [
-                    '//div[contains(@class, "message-in")]//span[@dir="ltr"]',
-                    '//div[contains(@class, "message-in")]//div[@data-pre-plain-text]//span',
-                    '//div[contains(@class, "message-in")]//span[contains(@class, "selectable-text")]'
-                ]
-                messages = []
-                for xpath in xpaths:
-                    try:
-                        messages = WebDriverWait(driver, 10).until(
-                            EC.presence_of_all_elements_located((By.XPATH, xpath))
-                        )
-                        if messages:
-                            logging.info(f"XPath bem-sucedido: {xpath}, encontradas {len(messages)} mensagens para {contact_name}")
-                            break
-                    except:
-                        logging.warning(f"XPath falhou: {xpath} para {contact_name}")
-                        continue
-                
-                if not messages:
-                    logging.error(f"Nenhuma mensagem encontrada para {contact_name} com qualquer XPath")
-                    time.sleep(7)
-                    continue
-                
-                # Processar as últimas mensagens
-                for msg in messages[-2:]:
-                    try:
-                        clean_msg = remove_non_bmp_chars(msg.text.strip())
-                        if clean_msg:
-                            message_hash = hashlib.sha256(clean_msg.encode()).hexdigest()
-                            cursor.execute('SELECT id FROM messages WHERE contact_id = ? AND message_hash = ?', (contact_id, message_hash))
-                            
-                            if not cursor.fetchone():
-                                sentiment = analyze_sentiment(clean_msg)
-                                log_message(cursor, conn, contact_id, clean_msg, 'user', sentiment)
-                                print(f"\nNova mensagem de {contact_name}: {clean_msg} (Sentimento: {sentiment})")
-                                logging.info(f"Nova mensagem de {contact_name}: {clean_msg} (Sentimento: {sentiment})")
-                                
-                                engagement = 'positivo' if sentiment in ['Positivo', 'Curioso'] else 'negativo' if sentiment == 'Negativo' else 'neutro'
-                                new_stage = 'nurturing' if sentiment in ['Positivo', 'Curioso'] else 'objeção' if sentiment == 'Negativo' else 'prospecção'
-                                
-                                cursor.execute('UPDATE contacts SET engagement_level = ?, current_stage = ?, last_interaction = ?, initial_message_sent = 1 WHERE id = ?', 
-                                               (engagement, new_stage, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), contact_id))
-                                conn.commit()
-                                
-                                new_messages = True
-                                
-                                cursor.execute('SELECT current_stage FROM contacts WHERE id = ?', (contact_id,))
-                                current_stage = cursor.fetchone()[0]
-                                
-                                response, script_id = get_sales_script(cursor, clean_msg, current_stage, contact_id, contact_name, product, pain_point, industry)
-                                if response:
-                                    time.sleep(random.uniform(2, 4))
-                                    send_message(driver, cursor, conn, contact_id, contact_name, response)
-                                    
-                                    if sentiment in ["Positivo", "Curioso"]:
-                                        mark_script_success(cursor, conn, script_id)
-                                    
-                                    lead_score_change = 15 if sentiment in ["Positivo", "Curioso"] else -10 if sentiment == "Negativo" else 0
-                                    cursor.execute('UPDATE contacts SET lead_score = lead_score + ? WHERE id = ?', 
-                                                   (lead_score_change, contact_id))
-                                    conn.commit()
-                                
-                                if re.search(r'\b(não|pare|stop|desinteressado)\b', clean_msg.lower()):
-                                    send_message(driver, cursor, conn, contact_id, contact_name,
-                                                 f"Entendido, {contact_name}. Respeito sua decisão. Caso queira conversar no futuro, é só me chamar! 😊")
-                                    cursor.execute('UPDATE contacts SET lead_score = 0, engagement_level = "negativo", current_stage = "opt-out" WHERE id = ?', 
-                                                   (contact_id,))
-                                    conn.commit()
-                                    return True
-                    except Exception as e:
-                        logging.error(f"Erro ao processar mensagem para {contact_name}: {str(e)}")
-                        driver.save_screenshot(f"erro_process_message_{contact_name}_{int(time.time())}.png")
-                        continue
-                
+                with metrics.timer('fetch_new_messages'):
+                    batch = transport.fetch_new_messages(contact_name)
+            except Exception as e:
+                logging.error(f"Erro ao ler mensagens para {contact_name} durante monitoramento: {str(e)}")
+                transport.capture_error("read_messages_loop", contact_name)
+                time.sleep(1)
+                continue
+            
+            if not batch:
+                # Depois de responder, uma leitura vazia indica que a rajada terminou
                 if new_messages:
                     break
-                
-                time.sleep(7)
+                continue
             
-            except Exception as e:
-                logging.error(f"Erro ao ler mensagens para {contact_name} durante monitoramento: {str(e)}")
-                driver.save_screenshot(f"erro_read_messages_loop_{contact_name}_{int(time.time())}.png")
-                time.sleep(7)
+            for item in batch:
+                try:
+                    wa_id = message_key(item)
+                    if seen_messages.seen(contact_id, wa_id):
+                        metrics.inc('duplicates_skipped')
+                        continue
+                    clean_msg = remove_non_bmp_chars(item['text'].strip())
+                    if clean_msg:
+                        status = process_incoming_message(transport, cursor, conn, contact_id, contact_name, product,
+                                                          clean_msg, pain_point, industry, wa_id)
+                        if status == 'opt-out':
+                            return True
+                        if status == 'processada':
+                            new_messages = True
+                except Exception as e:
+                    logging.error(f"Erro ao processar mensagem {item.get('id')} para {contact_name}: {str(e)}")
+                    transport.capture_error("process_message", contact_name)
+                    continue
         
         return new_messages
 
     except Exception as e:
         logging.error(f"Erro ao iniciar leitura de mensagens para {contact_name}: {str(e)}")
-        driver.save_screenshot(f"erro_read_messages_{contact_name}_{int(time.time())}.png")
+        transport.capture_error("read_messages", contact_name)
         return False
 
-def send_message(driver, cursor, conn, contact_id, contact_name, message):
-    retries = 3
-    for attempt in range(retries):
-        try:
-            search_box = WebDriverWait(driver, 20).until(
-                EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]'))
-            )
-            search_box.click()
-            search_box.send_keys(Keys.CONTROL + "a")
-            search_box.send_keys(Keys.DELETE)
-            search_box.send_keys(contact_name)
-            time.sleep(7)
-
-            contact = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
-            )
-            contact.click()
-            time.sleep(7)
+# Perfis de tempo do envio. 'humano' reproduz a digitação original caractere a caractere;
+# os demais inserem o texto de uma vez e só simulam pausas humanas quando configurado.
+# 'send_rate' é o limite global da fila de saída: (mensagens por minuto, rajada); 0 = sem limite.
+SEND_PROFILES = {
+    'humano':  {'bulk': False, 'char_delay': (0.05, 0.15), 'search_pause': (7, 7), 'open_pause': (7, 7),
+                'typing_delay': (1, 1), 'reply_delay': (2, 4), 'after_send': (2, 4), 'send_rate': (6, 2)},
+    'natural': {'bulk': True, 'char_delay': (0, 0), 'search_pause': (1, 1), 'open_pause': (1, 1),
+                'typing_delay': (0.8, 2.5), 'reply_delay': (1, 2), 'after_send': (0.5, 1), 'send_rate': (20, 5)},
+    'rápido':  {'bulk': True, 'char_delay': (0, 0), 'search_pause': (0, 0), 'open_pause': (0, 0),
+                'typing_delay': (0, 0), 'reply_delay': (0, 0), 'after_send': (0, 0), 'send_rate': (0, 0)},
+}
+SEND_PROFILE = 'natural'
 
-            msg_box = WebDriverWait(driver, 20).until(
-                EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
-            )
-            
-            msg_box.click()
-            time.sleep(1)
-            clean_message = remove_non_bmp_chars(message)
-            
-            for char in clean_message:
-                msg_box.send_keys(char)
-                time.sleep(random.uniform(0.05, 0.15))
-            
-            time.sleep(1)
-            msg_box.send_keys(Keys.ENTER)
-            print(f"\n➡️ Mensagem enviada para {contact_name}: '{clean_message}'")
-            logging.info(f"Mensagem enviada para {contact_name}: {clean_message}")
-            
-            sentiment = analyze_sentiment(clean_message)
-            log_message(cursor, conn, contact_id, clean_message, 'bot', sentiment)
+_send_timings = {'abrir': deque(maxlen=500), 'digitar': deque(maxlen=500), 'total': deque(maxlen=500)}
+
+def send_profile():
+    return SEND_PROFILES[SEND_PROFILE]
+
+def human_pause(key):
+    low, high = send_profile()[key]
+    if high > 0:
+        time.sleep(random.uniform(low, high))
+
+def send_timing_stats():
+    stats = {}
+    for phase, values in _send_timings.items():
+        ordered = sorted(values)
+        stats[phase] = {
+            'media': sum(ordered) / len(ordered) if ordered else 0.0,
+            'p95': ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+            'envios': len(ordered),
+        }
+    return stats
+
+SEND_RETRIES = 3
+SEND_RETRY_BACKOFF = 5  # segundos antes da 2ª tentativa; dobra a cada falha
+
+def _record_sent(cursor, conn, contact_id, contact_name, message, elapsed):
+    metrics.inc('messages_out')
+    _send_timings['total'].append(elapsed)
+    print(f"\n➡️ Mensagem enviada para {contact_name}: '{message}'")
+    logging.info(f"Mensagem enviada para {contact_name} em {elapsed:.2f}s (perfil {SEND_PROFILE}): {message}")
+    
+    sentiment = analyze_sentiment(message)
+    log_message(cursor, conn, contact_id, message, 'bot', sentiment)
+
+@metrics.timed('send_message')
+def send_message(transport, cursor, conn, contact_id, contact_name, message):
+    # Envio síncrono, usado quando a fila de saída não está ativa
+    clean_message = remove_non_bmp_chars(message)
+    started = time.perf_counter()
+    for attempt in range(SEND_RETRIES):
+        if attempt:
+            metrics.inc('send_retries')
+            time.sleep(SEND_RETRY_BACKOFF * 2 ** (attempt - 1))
+        if transport.send(contact_name, clean_message):
+            break
+    else:
+        logging.error(f"Falha ao enviar mensagem para {contact_name} após {SEND_RETRIES} tentativas")
+        metrics.inc('send_failures')
+        return False
+    _record_sent(cursor, conn, contact_id, contact_name, clean_message, time.perf_counter() - started)
+    
+    human_pause('after_send')
+    return True
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = rate  # fichas por segundo
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+    
+    def reserve(self, now=None):
+        # Consome uma ficha e devolve 0, ou devolve quantos segundos faltam para a próxima
+        now = self.clock() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+# Fila de saída: uma thread dedicada digita e envia, enquanto a thread principal continua lendo.
+# Um envio por vez por contato (em ordem), limite global por token bucket, respostas pendentes
+# para o mesmo contato juntadas numa só mensagem e novas tentativas com espera crescente que não
+# bloqueiam a leitura. Respostas passam na frente de prospecção e follow-ups. O banco só é tocado
+# pela thread principal, em apply_results.
+OUTBOX_ENABLED = True
+OUTBOX_STOP_TIMEOUT = 60
+
+class OutboundQueue:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.transport = None
+        self.bucket = None
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # contact_id -> deque de envios, na ordem de chegada
+        self._in_flight = None
+        self._results = deque()
+        self._thread = None
+        self._stopping = False
+    
+    def start(self, transport):
+        if self._thread is not None:
+            self.stop()
+        rate, burst = send_profile().get('send_rate', (0, 0))
+        self.bucket = TokenBucket(rate / 60, max(1, burst), self.clock) if rate else None
+        self.transport = transport
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+        self._thread.start()
+    
+    def running_for(self, transport):
+        return self._thread is not None and self.transport is transport
+    
+    def stop(self, timeout=OUTBOX_STOP_TIMEOUT):
+        # Envia o que ainda está na fila (sem as pausas de resposta) e encerra a thread
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"Fila de saída encerrada com {len(self)} envios pendentes")
+        self._thread = None
+        self.transport = None
+    
+    def submit(self, contact_id, contact_name, message, on_sent=None, delay=0.0, reply=False):
+        with self._cond:
+            items = self._pending.get(contact_id)
+            if items:
+                # Ainda não começou a ser enviado: vira parte da mesma mensagem
+                item = items[-1]
+                if message not in item['texts']:
+                    item['texts'].append(message)
+                item['reply'] = item['reply'] or reply
+                metrics.inc('sends_coalesced')
+            else:
+                item = {'contact_id': contact_id, 'name': contact_name, 'texts': [message], 'callbacks': [],
+                        'not_before': self.clock() + delay, 'attempt': 0, 'reply': reply}
+                self._pending.setdefault(contact_id, deque()).append(item)
+            if on_sent is not None:
+                item['callbacks'].append(on_sent)
+            self._cond.notify()
+    
+    def has_pending(self, contact_id):
+        with self._cond:
+            return contact_id in self._pending or (self._in_flight is not None and self._in_flight['contact_id'] == contact_id)
+    
+    def __len__(self):
+        with self._cond:
+            return sum(len(items) for items in self._pending.values()) + (self._in_flight is not None)
+    
+    def _take(self):
+        with self._cond:
+            while True:
+                if self._stopping and not self._pending:
+                    return None
+                now = self.clock()
+                ready, wake = None, None
+                for contact_id, items in self._pending.items():
+                    not_before = items[0]['not_before']
+                    if self._stopping or not_before <= now:
+                        if ready is None:
+                            ready = contact_id
+                        if items[0]['reply']:
+                            ready = contact_id
+                            break
+                    else:
+                        wake = not_before if wake is None else min(wake, not_before)
+                if ready is not None:
+                    wait = self.bucket.reserve(now) if self.bucket is not None else 0.0
+                    if not wait:
+                        items = self._pending[ready]
+                        item = self._in_flight = items.popleft()
+                        if items:
+                            self._pending.move_to_end(ready)  # revezamento entre contatos
+                        else:
+                            del self._pending[ready]
+                        return item
+                    wake = now + wait
+                self._cond.wait(None if wake is None else max(0.0, wake - now))
+    
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            # Espaço, não quebra de linha: no campo de mensagem um \n equivale a Enter e dividiria o envio
+            message = remove_non_bmp_chars(' '.join(item['texts']))
+            started = time.perf_counter()
+            try:
+                sent = self.transport.send(item['name'], message)
+            except Exception as e:
+                logging.error(f"Erro ao enviar mensagem para {item['name']}: {str(e)}")
+                sent = False
+            elapsed = time.perf_counter() - started
+            metrics.observe('send_message', elapsed)
             
-            logging.info(f"Atualizando initial_message_sent para {contact_name}")
-            time.sleep(random.uniform(2, 4))
+            with self._cond:
+                self._in_flight = None
+                item['attempt'] += 1
+                if not sent and item['attempt'] < SEND_RETRIES:
+                    # Volta para o início da fila do contato: as mensagens seguintes esperam por ela
+                    metrics.inc('send_retries')
+                    item['not_before'] = self.clock() + SEND_RETRY_BACKOFF * 2 ** (item['attempt'] - 1)
+                    self._pending.setdefault(item['contact_id'], deque()).appendleft(item)
+                    continue
+                self._results.append((item, message, sent, elapsed))
+            if sent:
+                human_pause('after_send')
+    
+    def apply_results(self, cursor, conn):
+        # Grava no banco os envios concluídos e avisa quem os pediu (thread principal)
+        if not self._results:
+            return
+        with write_batch(conn):
+            while self._results:
+                item, message, sent, elapsed = self._results.popleft()
+                if sent:
+                    _record_sent(cursor, conn, item['contact_id'], item['name'], message, elapsed)
+                else:
+                    logging.error(f"Falha ao enviar mensagem para {item['name']} após {SEND_RETRIES} tentativas")
+                    metrics.inc('send_failures')
+                for callback in item['callbacks']:
+                    try:
+                        callback(sent)
+                    except Exception as e:
+                        logging.error(f"Erro ao registrar envio para {item['name']}: {str(e)}")
+
+outbox = OutboundQueue()
+
+def queue_message(transport, cursor, conn, contact_id, contact_name, message, on_sent=None, delay_key=None, reply=False):
+    # `on_sent(enviada)` roda na thread principal quando o envio termina; `delay_key` é a pausa
+    # humana do perfil aplicada antes do envio; `reply` marca respostas a mensagens recebidas
+    if outbox.running_for(transport):
+        delay = random.uniform(*send_profile()[delay_key]) if delay_key else 0.0
+        outbox.submit(contact_id, contact_name, message, on_sent, delay, reply=reply)
+        return
+    if delay_key:
+        human_pause(delay_key)
+    sent = send_message(transport, cursor, conn, contact_id, contact_name, message)
+    if on_sent is not None:
+        on_sent(sent)
+
+def _mark_used_on_send(cursor, conn, script_id, success=False):
+    def on_sent(sent):
+        if sent:
+            with write_batch(conn):
+                mark_script_used(cursor, conn, script_id)
+                if success:
+                    mark_script_success(cursor, conn, script_id)
+    return on_sent
+
+def _mark_initial_on_send(cursor, conn, contact_id, script_id):
+    def on_sent(sent):
+        if sent:
+            with write_batch(conn):
+                mark_script_used(cursor, conn, script_id)
+                mark_initial_message_sent(cursor, contact_id)
+    return on_sent
+
+# Camada de transporte: tudo o que o bot precisa do WhatsApp passa por esta interface, o que
+# permite trocar o Selenium por um backend simulado em testes de carga. Os quatro métodos de
+# conversa são obrigatórios; capture_error, maintain e close são ganchos opcionais.
+class Transport(ABC):
+    @abstractmethod
+    def list_chats(self):
+        # Lista de {'name': ..., 'unread': bool}
+        raise NotImplementedError
+    
+    @abstractmethod
+    def open_chat(self, contact_name):
+        # True se a conversa existe e ficou ativa
+        raise NotImplementedError
+    
+    @abstractmethod
+    def fetch_new_messages(self, contact_name):
+        # Mensagens recebidas novas da conversa ativa: lista de {'id': ..., 'text': ...}
+        raise NotImplementedError
+    
+    @abstractmethod
+    def send(self, contact_name, text):
+        raise NotImplementedError
+    
+    def capture_error(self, label, detail=None):
+        # `label` é o tipo de erro (limite de capturas); `detail` identifica o caso, ex.: o contato
+        pass
+    
+    def maintain(self):
+        # Chamado entre atendimentos, quando nenhuma conversa está em andamento
+        pass
+    
+    def close(self):
+        pass
+
+# Modo de leitura: 'observer' (MutationObserver injetado na página) ou 'polling' (XPaths com espera fixa)
+INGESTION_MODE = 'observer'
+OBSERVER_WAIT_MS = 800
+POLL_INTERVAL = 7
+
+# Observa o painel da conversa e enfileira cada mensagem recebida nova com seu data-id do WhatsApp.
+# As últimas `seed` mensagens já exibidas também entram na fila (a deduplicação descarta as conhecidas).
+_MESSAGE_OBSERVER_JS = """
+const seed = arguments[0];
+const pane = document.querySelector('#main');
+if (!pane) return false;
+const current = window.__salesBotObserver;
+if (current && current.pane === pane) return true;
+if (current) current.observer.disconnect();
+
+const queue = [];
+const seen = new Set();
+const collect = (row) => {
+    const id = row.getAttribute('data-id');
+    if (!id || seen.has(id)) return;
+    if (!row.closest('.message-in') && !row.querySelector('.message-in')) return;
+    const textEl = row.querySelector('span.selectable-text');
+    if (!textEl) return;
+    seen.add(id);
+    queue.push({id: id, text: textEl.innerText});
+};
+const existing = Array.from(pane.querySelectorAll('[data-id]')).filter(
+    (row) => row.closest('.message-in') || row.querySelector('.message-in'));
+existing.slice(0, Math.max(existing.length - seed, 0)).forEach((row) => seen.add(row.getAttribute('data-id')));
+if (seed > 0) existing.slice(-seed).forEach(collect);
+
+const observer = new MutationObserver((mutations) => {
+    for (const mutation of mutations) {
+        for (const node of mutation.addedNodes) {
+            if (node.nodeType !== 1) continue;
+            if (node.hasAttribute('data-id')) collect(node);
+            node.querySelectorAll('[data-id]').forEach(collect);
+        }
+    }
+});
+observer.observe(pane, {childList: true, subtree: true});
+window.__salesBotQueue = queue;
+window.__salesBotObserver = {pane: pane, observer: observer};
+return true;
+"""
+
+# Esvazia a fila em uma única chamada assíncrona, aguardando até `wait_ms` se ela estiver vazia.
+# Retorna null quando o observer se perdeu (página recarregada ou painel da conversa substituído).
+_DRAIN_QUEUE_JS = """
+const waitMs = arguments[0];
+const done = arguments[arguments.length - 1];
+const start = Date.now();
+const poll = () => {
+    const state = window.__salesBotObserver;
+    if (!state || !document.contains(state.pane)) return done(null);
+    const queue = window.__salesBotQueue;
+    if (queue.length || Date.now() - start >= waitMs) return done(queue.splice(0, queue.length));
+    setTimeout(poll, 50);
+};
+poll();
+"""
+
+_CHAT_LIST_JS = """
+const chats = [];
+document.querySelectorAll('div[aria-label="Lista de conversas"] [role="listitem"], div[aria-label="Lista de conversas"] [role="row"]').forEach((row) => {
+    const title = row.querySelector('span[title]');
+    if (!title) return;
+    const badge = row.querySelector('span[aria-label*="não lida"], span[aria-label*="unread"]');
+    chats.push({name: title.getAttribute('title'), unread: !!badge});
+});
+return chats;
+"""
+
+# Capturas de tela de erro: no máximo uma por tipo de erro a cada SCREENSHOT_MIN_INTERVAL,
+# falhas idênticas (mesma imagem) não são regravadas, e o diretório funciona como buffer
+# circular de SCREENSHOT_MAX_FILES arquivos, com as capturas mais antigas recomprimidas
+SCREENSHOT_DIR = 'capturas'
+SCREENSHOT_MIN_INTERVAL = 300
+SCREENSHOT_MAX_FILES = 50
+SCREENSHOT_KEEP_RAW = 10
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def recompress_png(data):
+    # Regrava os blocos IDAT com zlib nível 9: o Chrome usa compressão rápida, e o
+    # resultado continua sendo um PNG válido e sem perdas
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    chunks, idat, position = [], [], len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if kind == b'IDAT':
+            if not idat:
+                chunks.append((kind, None))
+            idat.append(body)
+        else:
+            chunks.append((kind, body))
+    if not idat:
+        return data
+    packed = zlib.compress(zlib.decompress(b''.join(idat)), 9)
+    output = [PNG_SIGNATURE]
+    for kind, body in chunks:
+        body = packed if body is None else body
+        output.append(struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body)))
+    result = b''.join(output)
+    return result if len(result) < len(data) else data
+
+class ScreenshotManager:
+    def __init__(self, directory=SCREENSHOT_DIR, min_interval=SCREENSHOT_MIN_INTERVAL, max_files=SCREENSHOT_MAX_FILES,
+                 keep_raw=SCREENSHOT_KEEP_RAW, clock=time.time):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.max_files = max_files
+        self.keep_raw = keep_raw
+        self.clock = clock
+        self._last_capture = {}
+        self._last_digest = {}
+        self._suppressed = {}
+    
+    def _suppress(self, label, reason):
+        self._suppressed[label] = self._suppressed.get(label, 0) + 1
+        metrics.inc(reason)
+    
+    def capture(self, driver, label, detail=None):
+        now = self.clock()
+        last = self._last_capture.get(label)
+        if last is not None and now - last < self.min_interval:
+            self._suppress(label, 'screenshots_rate_limited')
+            return None
+        self._last_capture[label] = now
+        
+        png = driver.get_screenshot_as_png()
+        digest = hashlib.sha1(png).hexdigest()
+        if self._last_digest.get(label) == digest:
+            self._suppress(label, 'screenshots_duplicate')
+            return None
+        self._last_digest[label] = digest
+        
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"erro_{label}_{int(now)}_{digest[:8]}.png")
+        with open(path, 'wb') as f:
+            f.write(png)
+        metrics.inc('screenshots')
+        logging.warning(f"Captura de erro {label} ({detail or '-'}) salva em {path}; "
+                        f"{self._suppressed.pop(label, 0)} ocorrências suprimidas desde a anterior")
+        self.enforce_retention()
+        return path
+    
+    def enforce_retention(self):
+        captures = sorted((entry for entry in os.scandir(self.directory) if entry.name.startswith('erro_')),
+                          key=lambda entry: entry.stat().st_mtime)
+        for entry in captures[:-self.max_files]:
+            os.remove(entry.path)
+        captures = captures[-self.max_files:]
+        for entry in captures[:max(len(captures) - self.keep_raw, 0)]:
+            if entry.name.endswith('.min.png'):
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    data = recompress_png(f.read())
+                target = entry.path[:-len('.png')] + '.min.png'
+                with open(target, 'wb') as f:
+                    f.write(data)
+                # Mantém a data original para a ordem do buffer circular
+                stat = entry.stat()
+                os.utime(target, (stat.st_atime, stat.st_mtime))
+                os.remove(entry.path)
+            except (OSError, zlib.error) as e:
+                logging.error(f"Erro ao comprimir a captura {entry.path}: {str(e)}")
+
+screenshots = ScreenshotManager()
+
+# Coloca o cursor no fim do texto já digitado (rascunho restaurado ao reabrir a conversa)
+_FOCUS_END_JS = """
+const box = arguments[0];
+box.focus();
+const range = document.createRange();
+range.selectNodeContents(box);
+range.collapse(false);
+const selection = window.getSelection();
+selection.removeAllRanges();
+selection.addRange(range);
+"""
+# Texto do campo de mensagem como o usuário vê (emojis viram <img alt>), conferido antes do Enter
+_COMPOSE_TEXT_JS = """
+let text = '';
+const walk = (node) => {
+    if (node.nodeType === Node.TEXT_NODE) text += node.data;
+    else if (node.tagName === 'IMG') text += node.alt || '';
+    else node.childNodes.forEach(walk);
+};
+walk(arguments[0]);
+return text;
+"""
+OBSERVER_POLL_STEP = 0.1  # segundos entre leituras da fila do observer, com o navegador livre
+SEND_WAIT_TIMEOUT = 90  # segundos que a leitura espera um envio em andamento antes de trocar de conversa
+
+def _compose_normalized(text):
+    return ' '.join(text.replace('\ufe0f', '').split())
+
+def _serialized(method):
+    # O driver do Selenium não é thread-safe: leitura (thread principal) e envio (fila de saída)
+    # se alternam a cada chamada ao driver. As pausas humanas ficam fora do lock.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._driver_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class SeleniumTransport(Transport):
+    def __init__(self, driver, lifecycle=None):
+        _load_selenium()
+        self.driver = driver
+        self.lifecycle = lifecycle
+        self._driver_lock = threading.RLock()
+        # Conversa aberta no momento, para evitar buscar e clicar de novo no mesmo contato
+        self.open_chat_name = None
+        self.observer_installed = False
+        # Caixa de mensagem da conversa aberta; vale enquanto a conversa não muda
+        self._chat_changes = 0
+        self._compose = None
+        # Conversa em que a fila de saída está digitando: a leitura não troca de conversa no meio
+        self._sending_chat = None
+        self._send_idle = threading.Condition(self._driver_lock)
+    
+    @_serialized
+    def list_chats(self):
+        return self.driver.execute_script(_CHAT_LIST_JS) or []
+    
+    def _set_open_chat(self, contact_name):
+        self.open_chat_name = contact_name
+        self.observer_installed = False
+        self._chat_changes += 1
+    
+    def is_chat_open(self, contact_name):
+        if self.open_chat_name != contact_name:
+            return False
+        # Confirma pelo cabeçalho da conversa, sem espera explícita
+        return bool(self.driver.find_elements(By.XPATH, f'//div[@id="main"]//header//span[@title="{contact_name}"]'))
+    
+    def open_chat(self, contact_name):
+        with self._driver_lock:
+            # Espera o envio para outra conversa terminar (o WhatsApp Web só aceita uma aba);
+            # trocar no meio faria o envio reabrir a conversa dele a cada tecla
+            deadline = time.time() + SEND_WAIT_TIMEOUT
+            while self._sending_chat not in (None, contact_name) and time.time() < deadline:
+                self._send_idle.wait(deadline - time.time())
+            if self.is_chat_open(contact_name):
+                return True
+            self._set_open_chat(None)
+            # Aguardar a lista de conversas
+            WebDriverWait(self.driver, 30).until(
+                EC.presence_of_element_located((By.XPATH, '//div[@aria-label="Lista de conversas"]'))
+            )
+            try:
+                contact_element = WebDriverWait(self.driver, 10).until(
+                    EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
+                )
+            except TimeoutException:
+                return False
+            contact_element.click()
+            self._set_open_chat(contact_name)
+        human_pause('open_pause')
+        return True
+    
+    def _search_and_open_chat(self, contact_name):
+        # Chamado com o lock; True se precisou abrir a conversa
+        if self.is_chat_open(contact_name):
+            return False
+        self._set_open_chat(None)
+        search_box = WebDriverWait(self.driver, 20).until(
+            EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]'))
+        )
+        search_box.click()
+        search_box.send_keys(Keys.CONTROL + "a")
+        search_box.send_keys(Keys.DELETE)
+        search_box.send_keys(contact_name)
+
+        contact = WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
+        )
+        contact.click()
+        # Limpa a busca: a lista filtrada esconderia as outras conversas da leitura
+        search_box.send_keys(Keys.CONTROL + "a")
+        search_box.send_keys(Keys.DELETE)
+        self._set_open_chat(contact_name)
+        return True
+    
+    def _compose_box(self, contact_name):
+        # Chamado com o lock. Se a conversa mudou (a leitura desistiu de esperar o envio), reabre;
+        # o texto é conferido antes do Enter, então um rascunho não restaurado não vira envio falso
+        if self._compose is not None and self._compose[0] == self._chat_changes and self.open_chat_name == contact_name:
+            return self._compose[1]
+        self._search_and_open_chat(contact_name)
+        msg_box = WebDriverWait(self.driver, 20).until(
+            EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
+        )
+        self.driver.execute_script(_FOCUS_END_JS, msg_box)
+        self._compose = (self._chat_changes, msg_box)
+        return msg_box
+    
+    def fetch_new_messages(self, contact_name):
+        # Um envio da fila de saída pode ter aberto outra conversa
+        if self.open_chat_name != contact_name and not self.open_chat(contact_name):
+            return []
+        if INGESTION_MODE == 'observer':
+            return self._drain_observer(contact_name)
+        return self._poll_messages(contact_name)
+    
+    def _drain_observer(self, contact_name):
+        # Leituras curtas da fila do observer, esperando fora do lock até OBSERVER_WAIT_MS
+        deadline = time.time() + OBSERVER_WAIT_MS / 1000
+        while True:
+            with self._driver_lock:
+                if self.open_chat_name != contact_name:
+                    return []
+                if not self.observer_installed:
+                    self.observer_installed = self.driver.execute_script(_MESSAGE_OBSERVER_JS, 2)
+                    if self.observer_installed:
+                        logging.info(f"Observer de mensagens instalado para {contact_name}")
+                batch = self.driver.execute_async_script(_DRAIN_QUEUE_JS, 0) if self.observer_installed else []
+                if batch is None:
+                    logging.warning(f"Observer perdido para {contact_name}. Reinstalando.")
+                    self.observer_installed = False
+                    return []
+            if batch or time.time() >= deadline:
+                return batch
+            time.sleep(OBSERVER_POLL_STEP)
+    
+    def _poll_messages(self, contact_name):
+        # Rolar para o final da conversa
+        with self._driver_lock:
+            message_pane = self.driver.find_element(By.XPATH, '//div[@id="main"]')
+            self.driver.execute_script("arguments[0].scrollTop = arguments[0].scrollHeight", message_pane)
+        time.sleep(POLL_INTERVAL)
+        logging.info(f"Verificando mensagens para {contact_name}")
+        with self._driver_lock:
+            if self.open_chat_name != contact_name:
+                return []
+            return self._read_incoming(contact_name)
+    
+    def _read_incoming(self, contact_name):
+        # Tentar diferentes XPaths para mensagens recebidas
+        xpaths = [
+            '//div[contains(@class, "message-in")]//span[@dir="ltr"]',
+            '//div[contains(@class, "message-in")]//div[@data-pre-plain-text]//span',
+            '//div[contains(@class, "message-in")]//span[contains(@class, "selectable-text")]'
+        ]
+        for xpath in xpaths:
+            try:
+                messages = WebDriverWait(self.driver, 10).until(
+                    EC.presence_of_all_elements_located((By.XPATH, xpath))
+                )
+                if messages:
+                    logging.info(f"XPath bem-sucedido: {xpath}, encontradas {len(messages)} mensagens para {contact_name}")
+                    # Processar as últimas mensagens
+                    return [{'id': self._message_id(msg), 'text': msg.text} for msg in messages[-2:]]
+            except TimeoutException:
+                logging.warning(f"XPath falhou: {xpath} para {contact_name}")
+                metrics.inc('xpath_fallbacks')
+        
+        logging.error(f"Nenhuma mensagem encontrada para {contact_name} com qualquer XPath")
+        return []
+    
+    def _message_id(self, element):
+        # data-id da linha da mensagem (o mesmo id que o observer coleta)
+        try:
+            return element.find_element(By.XPATH, './ancestor::div[@data-id][1]').get_attribute('data-id')
+        except Exception:
+            return None
+    
+    def _clear_compose(self, msg_box):
+        # Chamado com o lock
+        if self.driver.execute_script(_COMPOSE_TEXT_JS, msg_box):
+            msg_box.send_keys(Keys.CONTROL + "a")
+            msg_box.send_keys(Keys.DELETE)
+    
+    def _submit(self, contact_name, text):
+        # Chamado com o lock: Enter só se o campo tem exatamente o texto da mensagem
+        msg_box = self._compose_box(contact_name)
+        typed = self.driver.execute_script(_COMPOSE_TEXT_JS, msg_box) or ''
+        if _compose_normalized(typed) != _compose_normalized(text):
+            logging.warning(f"Texto digitado para {contact_name} não confere com a mensagem; envio não confirmado")
+            # A próxima tentativa começa com o campo vazio
+            self._clear_compose(msg_box)
+            return False
+        msg_box.send_keys(Keys.ENTER)
+        return True
+    
+    def _type_message(self, contact_name, text):
+        # True se a mensagem foi conferida e enviada com Enter
+        if not send_profile()['bulk']:
+            # O lock é tomado a cada tecla e a pausa entre teclas fica fora dele
+            for char in text:
+                with self._driver_lock:
+                    self._compose_box(contact_name).send_keys(char)
+                human_pause('char_delay')
+            with self._driver_lock:
+                return self._submit(contact_name, text)
+        # Inserção única do texto, como uma colagem, conferida e enviada sem soltar o lock
+        human_pause('typing_delay')
+        with self._driver_lock:
+            msg_box = self._compose_box(contact_name)
+            self.driver.execute_script("arguments[0].focus(); document.execCommand('insertText', false, arguments[1]);", msg_box, text)
+            if not msg_box.text.strip():
+                msg_box.send_keys(text)
+            return self._submit(contact_name, text)
+    
+    def send(self, contact_name, text):
+        # Uma tentativa; quem chama decide se e quando tentar de novo
+        with self._driver_lock:
+            self._sending_chat = contact_name
+        try:
+            started = time.perf_counter()
+            if self.open_chat_name != contact_name:
+                human_pause('search_pause')
+                with self._driver_lock:
+                    self._compose_box(contact_name)
+                human_pause('open_pause')
+            with self._driver_lock:
+                # Sobra de uma tentativa anterior que não foi enviada
+                self._clear_compose(self._compose_box(contact_name))
+            opened = time.perf_counter()
+
+            if not self._type_message(contact_name, text):
+                return False
+            finished = time.perf_counter()
+            _send_timings['abrir'].append(opened - started)
+            _send_timings['digitar'].append(finished - opened)
+            metrics.observe('send_open_chat', opened - started)
+            metrics.observe('send_typing', finished - opened)
             return True
         except Exception as e:
-            logging.error(f"Tentativa {attempt+1}/{retries} falhou ao enviar mensagem para {contact_name}: {str(e)}")
-            driver.save_screenshot(f"erro_send_message_{contact_name}_{int(time.time())}.png")
-            time.sleep(7)
-    logging.error(f"Falha ao enviar mensagem para {contact_name} após {retries} tentativas")
-    return False
+            logging.error(f"Falha ao enviar mensagem para {contact_name}: {str(e)}")
+            self.capture_error("send_message", contact_name)
+            with self._driver_lock:
+                self._set_open_chat(None)
+            return False
+        finally:
+            with self._driver_lock:
+                self._sending_chat = None
+                self._send_idle.notify_all()
+    
+    @_serialized
+    def capture_error(self, label, detail=None):
+        try:
+            screenshots.capture(self.driver, label, detail)
+        except Exception as e:
+            logging.error(f"Falha ao capturar a tela para {label}: {str(e)}")
+    
+    @_serialized
+    def maintain(self):
+        # O estado das conversas fica no banco e na memória do bot, não na página: trocar o
+        # navegador só exige reabrir a conversa e reinstalar o observer (que relê as últimas
+        # mensagens; as já processadas são descartadas pelo índice de mensagens vistas)
+        if self._sending_chat is not None:
+            return  # recicla no próximo intervalo, sem derrubar um envio no meio
+        if self.lifecycle is not None and self.lifecycle.maybe_recycle():
+            self.driver = self.lifecycle.driver
+            self._set_open_chat(None)
+    
+    @_serialized
+    def close(self):
+        if self.lifecycle is not None:
+            self.lifecycle.close()
+        else:
+            self.driver.quit()
 
-def generate_analytics(cursor):
-    print("\n📊 Relatório de Contatos:")
-    cursor.execute('SELECT name, lead_score, engagement_level, current_stage FROM contacts ORDER BY lead_score DESC')
-    for name, score, engagement, stage in cursor.fetchall():
+# Respostas usadas pelo backend simulado
+MOCK_REPLIES = ['oi', 'quero saber mais', 'achei caro', 'não tenho tempo agora', 'me explique melhor',
+                'ok', 'quero comprar', 'talvez depois', 'como funciona?', 'interessado!']
+
+class MockTransport(Transport):
+    # Backend em memória: cada contato responde às mensagens do bot com a probabilidade e o atraso
+    # configurados, e mensagens espontâneas podem ser agendadas com schedule_message.
+    def __init__(self, contact_names, reply_probability=0.8, reply_delay=(0.0, 0.05), send_latency=0.0,
+                 fetch_wait=0.02, replies=MOCK_REPLIES, missing_contacts=(), seed=None):
+        self.reply_probability = reply_probability
+        self.reply_delay = reply_delay
+        self.send_latency = send_latency
+        self.fetch_wait = fetch_wait
+        self.replies = replies
+        self.missing_contacts = set(missing_contacts)
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._inbox = {name: [] for name in contact_names}
+        self._waiting_since = {}
+        self._counter = itertools.count()
+        self._session = os.urandom(4).hex()  # ids únicos entre sessões e execuções, como os do WhatsApp
+        self.sent = {name: [] for name in contact_names}
+        self.reply_latencies = []
+        self.delivered = 0
+        self.open_chat_name = None
+    
+    def schedule_message(self, contact_name, text, delay=0.0):
+        with self._lock:
+            message_id = f"mock_{self._session}_{next(self._counter)}"
+            heapq.heappush(self._inbox[contact_name], (time.time() + delay, message_id, text))
+            return message_id
+    
+    def list_chats(self):
+        now = time.time()
+        with self._lock:
+            return [{'name': name, 'unread': bool(inbox) and inbox[0][0] <= now}
+                    for name, inbox in self._inbox.items() if name not in self.missing_contacts]
+    
+    def open_chat(self, contact_name):
+        if contact_name not in self._inbox or contact_name in self.missing_contacts:
+            return False
+        self.open_chat_name = contact_name
+        return True
+    
+    def fetch_new_messages(self, contact_name):
+        deadline = time.time() + self.fetch_wait
+        while True:
+            now = time.time()
+            with self._lock:
+                inbox = self._inbox[contact_name]
+                batch = []
+                while inbox and inbox[0][0] <= now:
+                    available_at, message_id, text = heapq.heappop(inbox)
+                    self._waiting_since.setdefault(contact_name, available_at)
+                    batch.append({'id': message_id, 'text': text})
+                next_at = inbox[0][0] if inbox else None
+            if batch:
+                self.delivered += len(batch)
+                return batch
+            if now >= deadline:
+                return []
+            time.sleep(min(deadline, next_at or deadline) - now)
+    
+    def send(self, contact_name, text):
+        if contact_name not in self._inbox:
+            return False
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        now = time.time()
+        with self._lock:
+            self.sent[contact_name].append(text)
+            waiting_since = self._waiting_since.pop(contact_name, None)
+            if waiting_since is not None:
+                self.reply_latencies.append(now - waiting_since)
+        if self.rng.random() < self.reply_probability:
+            self.schedule_message(contact_name, self.rng.choice(self.replies), self.rng.uniform(*self.reply_delay))
+        return True
+    
+    def capture_error(self, label, detail=None):
+        logging.warning(f"Erro no transporte simulado: {label} ({detail or '-'})")
+
+# Prioridade dos contatos: mensagens não lidas primeiro, depois lead_score, estágio e conversa recente
+STAGE_PRIORITY = {'fechamento': 40, 'objeção': 30, 'nurturing': 20, 'prospecção': 10, 'follow-up': 5, 'opt-out': -100}
+UNREAD_PRIORITY = 1000
+RECENCY_BONUS = 30          # pontos para quem interagiu agora; cai 1 ponto por minuto de silêncio
+AGING_SECONDS = 60          # cada minuto sem atendimento vale 1 ponto (evita inanição)
+CONTACT_TIME_SLICE = 30     # segundos máximos lendo um contato com mensagens novas
+IDLE_TIME_SLICE = 5         # segundos máximos lendo um contato sem sinal de mensagem nova
+
+class ContactScheduler:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._contacts = {}
+        self._ids_by_name = {}
+        self._counter = itertools.count()
+        self._unread = 0
+        self.served = 0
+        self.max_depth = 0
+        self.response_times = deque(maxlen=1000)
+    
+    def add(self, contact_id, name, lead_score=50, stage='prospecção', last_interaction_ts=None, **extra):
+        now = self.clock()
+        self._contacts[contact_id] = {
+            'id': contact_id, 'name': name, 'lead_score': lead_score, 'stage': stage,
+            'last_interaction_ts': last_interaction_ts or now, 'last_served': now,
+            'unread_since': None, 'in_service': False, 'version': 0, **extra
+        }
+        self._ids_by_name[name] = contact_id
+        self._push(contact_id, now)
+    
+    def _priority(self, contact, now):
+        score = contact['lead_score'] + STAGE_PRIORITY.get(contact['stage'], 0)
+        if contact['unread_since'] is not None:
+            score += UNREAD_PRIORITY
+        score += max(0, RECENCY_BONUS - (now - contact['last_interaction_ts']) / 60)
+        # O envelhecimento cresce igual para todos, então basta descontar o último atendimento
+        return score - contact['last_served'] / AGING_SECONDS
+    
+    def _push(self, contact_id, now):
+        contact = self._contacts[contact_id]
+        contact['version'] += 1
+        heapq.heappush(self._heap, (-self._priority(contact, now), next(self._counter), contact_id, contact['version']))
+    
+    def mark_unread(self, contact_id, now=None):
+        contact = self._contacts.get(contact_id)
+        if contact is None or contact['unread_since'] is not None:
+            return
+        now = self.clock() if now is None else now
+        contact['unread_since'] = now
+        self._unread += 1
+        self.max_depth = max(self.max_depth, self._unread)
+        if not contact['in_service']:
+            self._push(contact_id, now)
+    
+    def mark_unread_by_name(self, name, now=None):
+        if name in self._ids_by_name:
+            self.mark_unread(self._ids_by_name[name], now)
+    
+    def next(self):
+        while self._heap:
+            _, _, contact_id, version = heapq.heappop(self._heap)
+            contact = self._contacts[contact_id]
+            if version == contact['version'] and not contact['in_service']:
+                contact['in_service'] = True
+                return contact
+        return None
+    
+    def time_slice(self, contact):
+        return CONTACT_TIME_SLICE if contact['unread_since'] is not None else IDLE_TIME_SLICE
+    
+    def done(self, contact_id, responded, now=None, **updates):
+        now = self.clock() if now is None else now
+        contact = self._contacts[contact_id]
+        contact.update(updates)
+        if contact['unread_since'] is not None:
+            if responded:
+                self.response_times.append(now - contact['unread_since'])
+            contact['unread_since'] = None
+            self._unread -= 1
+        contact['in_service'] = False
+        contact['last_served'] = now
+        self.served += 1
+        self._push(contact_id, now)
+    
+    def depth(self):
+        return self._unread
+    
+    def __len__(self):
+        return len(self._contacts)
+    
+    def stats(self):
+        times = sorted(self.response_times)
+        return {
+            'fila': self._unread,
+            'fila_max': self.max_depth,
+            'atendimentos': self.served,
+            'resposta_media': sum(times) / len(times) if times else 0.0,
+            'resposta_p95': times[int(len(times) * 0.95)] if times else 0.0,
+        }
+
+def service_contact(transport, cursor, conn, scheduler, contact, product):
+    contact_id, name = contact['id'], contact['name']
+    industry, pain_point = contact.get('industry'), contact.get('pain_point')
+    responded = False
+    updates = {}
+    try:
+        update_contact(cursor, conn, name, industry, pain_point)
+        
+        cursor.execute('SELECT initial_message_sent FROM contacts WHERE id = ?', (contact_id,))
+        initial_sent = cursor.fetchone()[0]
+        
+        # Se a mensagem inicial ainda está na fila de saída, não enfileira outra
+        if not initial_sent and not outbox.has_pending(contact_id):
+            response, script_id = get_sales_script(cursor, 'oi', 'prospecção', contact_id, name, product, pain_point, industry)
+            if response:
+                queue_message(transport, cursor, conn, contact_id, name, response,
+                              on_sent=_mark_initial_on_send(cursor, conn, contact_id, script_id))
+        
+        responded = read_messages(transport, cursor, conn, contact_id, name, product, pain_point, industry,
+                                  timeout=scheduler.time_slice(contact))
+        
+        cursor.execute('SELECT lead_score, current_stage, last_interaction_ts FROM contacts WHERE id = ?', (contact_id,))
+        lead_score, stage, last_interaction_ts = cursor.fetchone()
+        updates = {'lead_score': lead_score, 'stage': stage, 'last_interaction_ts': last_interaction_ts}
+    finally:
+        # O contato volta para a fila mesmo se o atendimento falhar
+        scheduler.done(contact_id, responded, **updates)
+    return responded
+
+# Agregados de relatório mantidos por triggers: cada escrita em contacts/sales_scripts
+# atualiza só as linhas afetadas, e o relatório não precisa varrer as tabelas
+ANALYTICS_TOP_K = 20
+
+def _score_bucket(column):
+    # Faixa de 10 pontos arredondada para baixo: no SQLite a divisão inteira trunca em
+    # direção a zero, e -5 / 10 cairia na faixa 0 a 9
+    return f'(({column}) - (({column}) < 0) * 9) / 10'
+
+ANALYTICS_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS funnel_counts (stage TEXT PRIMARY KEY, contacts INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS lead_score_buckets (bucket INTEGER PRIMARY KEY, contacts INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS script_stage_stats (stage TEXT PRIMARY KEY, uses INTEGER NOT NULL DEFAULT 0, successes INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS analytics_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL DEFAULT 0)',
+    '''CREATE TRIGGER IF NOT EXISTS trg_contacts_analytics_insert AFTER INSERT ON contacts BEGIN
+        INSERT INTO funnel_counts (stage, contacts) VALUES (NEW.current_stage, 1)
+            ON CONFLICT(stage) DO UPDATE SET contacts = contacts + 1;
+        INSERT INTO lead_score_buckets (bucket, contacts) VALUES (''' + _score_bucket('NEW.lead_score') + ''', 1)
+            ON CONFLICT(bucket) DO UPDATE SET contacts = contacts + 1;
+        UPDATE analytics_state SET version = version + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_contacts_analytics_delete AFTER DELETE ON contacts BEGIN
+        UPDATE funnel_counts SET contacts = contacts - 1 WHERE stage = OLD.current_stage;
+        UPDATE lead_score_buckets SET contacts = contacts - 1 WHERE bucket = ''' + _score_bucket('OLD.lead_score') + ''';
+        UPDATE analytics_state SET version = version + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_contacts_analytics_stage AFTER UPDATE OF current_stage ON contacts
+    WHEN OLD.current_stage IS NOT NEW.current_stage BEGIN
+        UPDATE funnel_counts SET contacts = contacts - 1 WHERE stage = OLD.current_stage;
+        INSERT INTO funnel_counts (stage, contacts) VALUES (NEW.current_stage, 1)
+            ON CONFLICT(stage) DO UPDATE SET contacts = contacts + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_contacts_analytics_score AFTER UPDATE OF lead_score ON contacts
+    WHEN ''' + _score_bucket('OLD.lead_score') + ' IS NOT ' + _score_bucket('NEW.lead_score') + ''' BEGIN
+        UPDATE lead_score_buckets SET contacts = contacts - 1 WHERE bucket = ''' + _score_bucket('OLD.lead_score') + ''';
+        INSERT INTO lead_score_buckets (bucket, contacts) VALUES (''' + _score_bucket('NEW.lead_score') + ''', 1)
+            ON CONFLICT(bucket) DO UPDATE SET contacts = contacts + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_contacts_analytics_version AFTER UPDATE OF lead_score, current_stage, engagement_level ON contacts
+    WHEN OLD.lead_score IS NOT NEW.lead_score OR OLD.current_stage IS NOT NEW.current_stage
+        OR OLD.engagement_level IS NOT NEW.engagement_level BEGIN
+        UPDATE analytics_state SET version = version + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_scripts_analytics AFTER UPDATE OF use_count, success_count ON sales_scripts BEGIN
+        INSERT INTO script_stage_stats (stage, uses, successes)
+            VALUES (NEW.stage, NEW.use_count - OLD.use_count, NEW.success_count - OLD.success_count)
+            ON CONFLICT(stage) DO UPDATE SET uses = uses + excluded.uses, successes = successes + excluded.successes;
+        UPDATE analytics_state SET version = version + 1;
+    END''',
+]
+
+def setup_analytics(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analytics_state'")
+    is_new = cursor.fetchone() is None
+    for statement in ANALYTICS_SCHEMA:
+        cursor.execute(statement)
+    if is_new:
+        # Primeira execução em um banco existente: carga inicial dos agregados
+        cursor.execute('INSERT INTO analytics_state (id, version) VALUES (1, 1)')
+        cursor.execute('INSERT INTO funnel_counts (stage, contacts) SELECT current_stage, COUNT(*) FROM contacts GROUP BY current_stage')
+        _fill_score_buckets(cursor)
+        cursor.execute('''
+            INSERT INTO script_stage_stats (stage, uses, successes)
+            SELECT stage, SUM(use_count), SUM(success_count) FROM sales_scripts GROUP BY stage
+        ''')
+
+def _fill_score_buckets(cursor):
+    bucket = _score_bucket('lead_score')
+    cursor.execute(f'INSERT INTO lead_score_buckets (bucket, contacts) SELECT {bucket}, COUNT(*) FROM contacts GROUP BY {bucket}')
+
+def top_leads(cursor, k=ANALYTICS_TOP_K):
+    cursor.execute('SELECT name, lead_score, engagement_level, current_stage FROM contacts ORDER BY lead_score DESC LIMIT ?', (k,))
+    return cursor.fetchall()
+
+_analytics_reported = {'version': None}
+
+def generate_analytics(cursor, top_k=ANALYTICS_TOP_K):
+    # Só reimprime quando algum agregado mudou desde o último relatório
+    cursor.execute('SELECT version FROM analytics_state WHERE id = 1')
+    version = cursor.fetchone()[0]
+    if version == _analytics_reported['version']:
+        return False
+    _analytics_reported['version'] = version
+    
+    print("\n🔻 Funil de Vendas:")
+    cursor.execute('SELECT stage, contacts FROM funnel_counts WHERE contacts > 0 ORDER BY contacts DESC')
+    for stage, count in cursor.fetchall():
+        print(f"{stage}: {count} contatos")
+    
+    print("\n🎯 Distribuição de Lead Score:")
+    cursor.execute('SELECT bucket, contacts FROM lead_score_buckets WHERE contacts > 0 ORDER BY bucket DESC')
+    for bucket, count in cursor.fetchall():
+        print(f"{bucket * 10} a {bucket * 10 + 9}: {count} contatos")
+    
+    print(f"\n📊 Top {top_k} Contatos:")
+    for name, score, engagement, stage in top_leads(cursor, top_k):
         print(f"{name}: Score={score}, Engajamento={engagement}, Estágio={stage}")
     
     print("\n📈 Desempenho dos Scripts:")
+    cursor.execute('SELECT stage, uses, successes FROM script_stage_stats WHERE uses > 0')
+    for stage, use, success in cursor.fetchall():
+        print(f"{stage} (total): {success / use * 100:.1f}% de sucesso ({success}/{use})")
     cursor.execute('SELECT stage, keyword, success_count, use_count FROM sales_scripts WHERE use_count > 0')
     for stage, keyword, success, use in cursor.fetchall():
         rate = (success / use * 100) if use > 0 else 0
         print(f"{stage} ({keyword}): {rate:.1f}% de sucesso ({success}/{use})")
+    return True
 
-def main():
-    conn, cursor = setup_database()
+# Importação em massa: lê CSV/JSONL em blocos e grava com upsert, uma transação por bloco
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_FIELDS = {
+    'name': 'name', 'nome': 'name',
+    'industry': 'industry', 'indústria': 'industry', 'industria': 'industry', 'setor': 'industry',
+    'pain_point': 'pain_point', 'ponto de dor': 'pain_point', 'ponto_de_dor': 'pain_point', 'dor': 'pain_point',
+}
+
+def _iter_contact_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip():
+                    record = {IMPORT_FIELDS.get(key.strip().lower()): value for key, value in json.loads(line).items()}
+                    yield record.get('name'), record.get('industry'), record.get('pain_point')
+            return
+        
+        # CSV no mesmo formato do cadastro manual (Nome;Indústria;Ponto de Dor), cabeçalho opcional
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=';,\t').delimiter
+        except csv.Error:
+            delimiter = ';'
+        reader = csv.reader(f, delimiter=delimiter)
+        first = next(reader, None)
+        if first is None:
+            return
+        columns = [IMPORT_FIELDS.get(cell.strip().lower()) for cell in first]
+        if 'name' not in columns:
+            columns = ['name', 'industry', 'pain_point']
+            reader = itertools.chain([first], reader)
+        for row in reader:
+            record = dict(zip(columns, row))
+            yield record.get('name'), record.get('industry'), record.get('pain_point')
+
+def _clean_field(value):
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def import_contacts(conn, path, chunk_size=IMPORT_CHUNK_SIZE, names=None):
+    # `names` (opcional): lista que recebe os nomes lidos do arquivo, na ordem
+    cursor = conn.cursor()
+    now, now_ts = current_time()
+    stats = {'lidos': 0, 'ignorados': 0, 'gravados': 0}
+    
+    def flush(chunk):
+        # Contatos já existentes só são tocados se indústria ou ponto de dor mudaram
+        cursor.executemany('''
+            INSERT INTO contacts (name, industry, pain_point, last_interaction, last_interaction_ts, lead_score, initial_message_sent, engagement_level, current_stage)
+            VALUES (?, ?, ?, ?, ?, 50, 0, 'neutro', 'prospecção')
+            ON CONFLICT(name) DO UPDATE SET industry = excluded.industry, pain_point = excluded.pain_point
+            WHERE contacts.industry IS NOT excluded.industry OR contacts.pain_point IS NOT excluded.pain_point
+        ''', chunk)
+        stats['gravados'] += cursor.rowcount
+        conn.commit()
+    
+    chunk = []
+    try:
+        for name, industry, pain_point in _iter_contact_rows(path):
+            stats['lidos'] += 1
+            name = _clean_field(name)
+            if not name:
+                stats['ignorados'] += 1
+                continue
+            chunk.append((name, _clean_field(industry), _clean_field(pain_point), now, now_ts))
+            if names is not None:
+                names.append(name)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    except sqlite3.OperationalError as e:
+        # Banco antigo com nomes duplicados ficou sem o índice único exigido pelo ON CONFLICT
+        logging.error(f"Importação de {path} interrompida: {str(e)}")
+        raise
+    finally:
+        _known_contacts.clear()
+        follow_ups.reset()
     
+    logging.info(f"Contatos importados de {path}: {stats}")
+    return stats
+
+LOAD_NAMES_CHUNK = 500  # abaixo do limite de parâmetros de versões antigas do SQLite
+
+def load_contacts(cursor, names=None, chunk_size=IMPORT_CHUNK_SIZE):
+    # Contatos que não pediram para parar: todos, ou só os de `names` (na ordem da lista)
+    if names is None:
+        cursor.execute("SELECT name, industry, pain_point FROM contacts WHERE current_stage IS NOT 'opt-out' ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+        return
+    names = list(dict.fromkeys(names))
+    for start in range(0, len(names), LOAD_NAMES_CHUNK):
+        chunk = names[start:start + LOAD_NAMES_CHUNK]
+        cursor.execute(f"""SELECT name, industry, pain_point FROM contacts
+                           WHERE current_stage IS NOT 'opt-out' AND name IN ({', '.join('?' * len(chunk))})""", chunk)
+        found = {row[0]: row for row in cursor.fetchall()}
+        yield from (found[name] for name in chunk if name in found)
+
+EXPORT_COLUMNS = ['id', 'name', 'industry', 'pain_point', 'lead_score', 'engagement_level', 'current_stage', 'last_interaction']
+
+def export_report(cursor, path, fmt='csv', chunk_size=1000):
+    # Exporta os contatos em blocos: memória constante mesmo com tabelas grandes
+    cursor.execute(f'SELECT {", ".join(EXPORT_COLUMNS)} FROM contacts ORDER BY lead_score DESC')
+    exported = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+            exported += len(rows)
+    logging.info(f"Relatório exportado para {path}: {exported} contatos")
+    return exported
+
+# Busca e arquivamento de mensagens. O banco principal mantém só as mensagens recentes, com
+# um índice FTS5 (tabela de conteúdo externo sincronizada por triggers). As antigas vão para um
+# arquivo SQLite separado, em segmentos de mensagens consecutivas comprimidos com zlib; o arquivo
+# guarda um FTS5 sem conteúdo (só o índice) e a posição de cada mensagem nos segmentos.
+MESSAGE_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        message, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+]
+ARCHIVE_DB = 'whatsapp_sales_arquivo.db'
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_SEGMENT_SIZE = 500      # mensagens por segmento comprimido
+ARCHIVE_SEGMENT_CACHE = 64      # segmentos descomprimidos mantidos em memória
+SEARCH_LIMIT = 50
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, first_id INTEGER NOT NULL, last_id INTEGER NOT NULL,
+        first_timestamp TEXT NOT NULL, last_timestamp TEXT NOT NULL, messages INTEGER NOT NULL, data BLOB NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS archived_messages (id INTEGER PRIMARY KEY, segment_id INTEGER NOT NULL,
+        contact_id INTEGER, timestamp TEXT NOT NULL)''',
+    'CREATE INDEX IF NOT EXISTS idx_archived_contact ON archived_messages(contact_id, id)',
+    """CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+        message, content='', tokenize='unicode61 remove_diacritics 2')""",
+]
+ARCHIVE_COLUMNS = ('id', 'contact_id', 'sender', 'timestamp', 'sentiment', 'wa_id', 'message')
+
+_segment_cache = OrderedDict()
+
+def open_archive(path=ARCHIVE_DB):
+    archive = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+    archive.execute('PRAGMA journal_mode=WAL')
+    for statement in ARCHIVE_SCHEMA:
+        archive.execute(statement)
+    archive.commit()
+    _segment_cache.clear()
+    return archive
+
+def _load_segment(archive, segment_id):
+    rows = _segment_cache.get(segment_id)
+    if rows is not None:
+        _segment_cache.move_to_end(segment_id)
+        return rows
+    data = archive.execute('SELECT data FROM segments WHERE id = ?', (segment_id,)).fetchone()[0]
+    rows = {row[0]: dict(zip(ARCHIVE_COLUMNS, row)) for row in json.loads(zlib.decompress(data))}
+    _segment_cache[segment_id] = rows
+    if len(_segment_cache) > ARCHIVE_SEGMENT_CACHE:
+        _segment_cache.popitem(last=False)
+    return rows
+
+def archive_messages(conn, archive, older_than_days=ARCHIVE_AFTER_DAYS, segment_size=ARCHIVE_SEGMENT_SIZE):
+    # Move as mensagens mais antigas que o limite para o arquivo, um segmento por transação.
+    # O segmento é gravado antes de as mensagens saírem do banco principal; se o processo cair
+    # entre as duas etapas, a próxima execução reconhece as já arquivadas e só as remove.
+    cursor = conn.cursor()
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    stats = {'mensagens': 0, 'segmentos': 0, 'bytes': 0}
+    while True:
+        cursor.execute(f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM messages WHERE timestamp < ? ORDER BY id LIMIT ?',
+                       (cutoff, segment_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        archived = {row[0] for row in archive.execute('SELECT id FROM archived_messages WHERE id BETWEEN ? AND ?',
+                                                      (rows[0][0], rows[-1][0]))}
+        fresh = [row for row in rows if row[0] not in archived]
+        if fresh:
+            data = zlib.compress(json.dumps(fresh, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+            with archive:
+                segment_id = archive.execute(
+                    'INSERT INTO segments (first_id, last_id, first_timestamp, last_timestamp, messages, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    (fresh[0][0], fresh[-1][0], fresh[0][3], fresh[-1][3], len(fresh), data)).lastrowid
+                archive.executemany('INSERT INTO archived_messages (id, segment_id, contact_id, timestamp) VALUES (?, ?, ?, ?)',
+                                    ((row[0], segment_id, row[1], row[3]) for row in fresh))
+                archive.executemany('INSERT INTO archive_fts (rowid, message) VALUES (?, ?)', ((row[0], row[6]) for row in fresh))
+            stats['segmentos'] += 1
+            stats['bytes'] += len(data)
+        with write_batch(conn):
+            cursor.executemany('INSERT OR IGNORE INTO archived_wa_ids (contact_id, wa_id, message_id) VALUES (?, ?, ?)',
+                               ((row[1], row[5], row[0]) for row in rows if row[5] is not None))
+            prune_archived_ids(cursor, {row[1] for row in rows})
+            cursor.executemany('DELETE FROM messages WHERE id = ?', ((row[0],) for row in rows))
+        stats['mensagens'] += len(rows)
+    if stats['segmentos']:
+        archive.execute("INSERT INTO archive_fts(archive_fts) VALUES ('optimize')")
+        archive.commit()
+    logging.info(f"Arquivamento: {stats['mensagens']} mensagens anteriores a {cutoff} em {stats['segmentos']} segmentos "
+                 f"({stats['bytes']} bytes comprimidos)")
+    return stats
+
+def compact_database(conn):
+    # Devolve ao sistema o espaço das mensagens arquivadas e compacta o índice de busca
+    cursor = conn.cursor()
+    commit(conn)
+    if _has_message_index(cursor):
+        cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+        conn.commit()
+    cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    cursor.execute('VACUUM')
+    cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def _has_message_index(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+    return cursor.fetchone() is not None
+
+def _fts_query(text):
+    # Cada palavra vira um termo entre aspas (sem operadores do FTS5); "preç*" busca por prefixo
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def search_messages(cursor, text, contact_id=None, limit=SEARCH_LIMIT, archive=None):
+    # Mensagens que contêm todas as palavras, das mais recentes para as mais antigas: primeiro o
+    # banco principal e, se faltar, o arquivo (`archive`, aberto com open_archive)
+    query = _fts_query(text)
+    if not query:
+        return []
+    contact_filter = ' AND m.contact_id = ?' if contact_id is not None else ''
+    params = [contact_id] if contact_id is not None else []
+    if _has_message_index(cursor):
+        # Ordenar pelo rowid do FTS (= id da mensagem): o FTS5 já entrega nessa ordem e para no LIMIT;
+        # ORDER BY m.id juntaria e ordenaria todos os resultados de uma palavra comum
+        cursor.execute(f'''SELECT m.{", m.".join(ARCHIVE_COLUMNS)} FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                           WHERE messages_fts MATCH ?{contact_filter} ORDER BY messages_fts.rowid DESC LIMIT ?''', [query] + params + [limit])
+    else:
+        words = [word.rstrip('*') for word in text.split()]
+        cursor.execute(f'''SELECT m.{", m.".join(ARCHIVE_COLUMNS)} FROM messages m
+                           WHERE {" AND ".join(["m.message LIKE ?"] * len(words))}{contact_filter} ORDER BY m.id DESC LIMIT ?''',
+                       [f'%{word}%' for word in words] + params + [limit])
+    results = [dict(zip(ARCHIVE_COLUMNS, row), arquivada=False) for row in cursor.fetchall()]
+    
+    if archive is not None and len(results) < limit:
+        located = archive.execute(f'''SELECT m.id, m.segment_id FROM archive_fts JOIN archived_messages m ON m.id = archive_fts.rowid
+                                      WHERE archive_fts MATCH ?{contact_filter} ORDER BY archive_fts.rowid DESC LIMIT ?''',
+                                  [query] + params + [limit - len(results)]).fetchall()
+        for message_id, segment_id in located:
+            results.append(dict(_load_segment(archive, segment_id)[message_id], arquivada=True))
+    return results
+
+# Re-pontuação offline: quando as regras de sentimento, tom ou pontuação mudam, recalcula o
+# sentimento gravado de cada mensagem e refaz a máquina de estados dos contatos (engajamento,
+# estágio e lead score) a partir do histórico. Os contatos são lidos em faixas de id; o sentimento
+# é calculado num pool de processos enquanto a próxima faixa é lida, e cada faixa é gravada numa
+# transação junto com o checkpoint, o que permite retomar uma execução interrompida.
+RESCORE_CHUNK_CONTACTS = 500
+RESCORE_PROGRESS_INTERVAL = 10  # segundos entre relatórios de progresso
+LEAD_SCORE_INITIAL = 50
+
+def _score_texts(texts):
+    # Executado nos processos do pool
+    return [(analyze_sentiment(text), detect_user_tone(text)) for text in texts]
+
+def _submit_scoring(pool, texts):
+    unique = list(dict.fromkeys(texts))
+    if pool is None:
+        return unique, _score_texts(unique)
+    return unique, pool.apply_async(_score_texts, (unique,))
+
+def _collect_scoring(pending):
+    unique, result = pending
+    scores = result if isinstance(result, list) else result.get()
+    return dict(zip(unique, scores))
+
+def replay_contact_state(events, state=None):
+    # Refaz as transições de process_incoming_message para as mensagens recebidas (texto, sentimento)
+    lead_score, engagement, stage = state or (LEAD_SCORE_INITIAL, 'neutro', 'prospecção')
+    for message, sentiment in events:
+        engagement, stage = classify_engagement(sentiment)
+        lead_score += LEAD_SCORE_DELTAS.get(sentiment, 0)
+        if OPT_OUT_PATTERN.search(message.lower()):
+            lead_score, engagement, stage = 0, 'negativo', 'opt-out'
+    return lead_score, engagement, stage
+
+def _archived_states(archive, pool, window):
+    # Estado de cada contato ao fim das mensagens arquivadas, de onde a re-pontuação do banco
+    # principal continua. Os segmentos do arquivo não são regravados.
+    states = {}
+    pending = deque()
+    
+    def fold(rows, scoring):
+        scores = _collect_scoring(scoring)
+        events = {}
+        for row in rows:
+            events.setdefault(row['contact_id'], []).append((row['message'], scores[row['message']][0]))
+        for contact_id, contact_events in events.items():
+            states[contact_id] = replay_contact_state(contact_events, states.get(contact_id))
+    
+    segments = archive.execute('SELECT id FROM segments ORDER BY first_id').fetchall()
+    for (segment_id,) in segments:
+        rows = [row for row in _load_segment(archive, segment_id).values() if row['sender'] == 'user']
+        pending.append((rows, _submit_scoring(pool, [row['message'] for row in rows])))
+        if len(pending) >= window:
+            fold(*pending.popleft())
+    while pending:
+        fold(*pending.popleft())
+    return states
+
+def rescore_messages(conn, processes=None, chunk_contacts=RESCORE_CHUNK_CONTACTS, restart=False, archive=None):
+    cursor = conn.cursor()
+    processes = os.cpu_count() if processes is None else processes
+    cursor.execute('SELECT last_contact_id FROM rescore_checkpoint WHERE id = 1')
+    row = cursor.fetchone()
+    start_after = row[0] if row and not restart else 0
+    if start_after:
+        logging.info(f"Re-pontuação retomada após o contato {start_after}")
+    
+    stats = {'mensagens': 0, 'alteradas': 0, 'contatos': 0, 'contatos_alterados': 0, 'tons': {}}
+    started = last_report = time.perf_counter()
+    window = max(2, 2 * processes)
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        initial_states = _archived_states(archive, pool, window) if archive is not None else {}
+        
+        def write(contact_ids, rows, scoring):
+            scores = _collect_scoring(scoring)
+            events, message_updates = {}, []
+            for message_id, contact_id, message, sender, old_sentiment in rows:
+                sentiment, tone = scores[message]
+                if sentiment != old_sentiment:
+                    message_updates.append((sentiment, message_id))
+                if sender == 'user':
+                    events.setdefault(contact_id, []).append((message, sentiment))
+                    stats['tons'][tone] = stats['tons'].get(tone, 0) + 1
+            
+            placeholders = ', '.join('?' * len(contact_ids))
+            cursor.execute(f'SELECT id, lead_score, engagement_level, current_stage FROM contacts WHERE id IN ({placeholders})',
+                           contact_ids)
+            contact_updates = []
+            for contact_id, *current in cursor.fetchall():
+                if contact_id not in events and contact_id not in initial_states:
+                    continue
+                state = replay_contact_state(events.get(contact_id, ()), initial_states.get(contact_id))
+                if list(state) != current:
+                    contact_updates.append((*state, contact_id))
+            
+            with write_batch(conn):
+                cursor.executemany('UPDATE messages SET sentiment = ? WHERE id = ?', message_updates)
+                cursor.executemany('UPDATE contacts SET lead_score = ?, engagement_level = ?, current_stage = ? WHERE id = ?',
+                                   contact_updates)
+                cursor.execute('INSERT OR REPLACE INTO rescore_checkpoint (id, last_contact_id) VALUES (1, ?)', (contact_ids[-1],))
+            stats['mensagens'] += len(rows)
+            stats['alteradas'] += len(message_updates)
+            stats['contatos'] += len(contact_ids)
+            stats['contatos_alterados'] += len(contact_updates)
+        
+        pending = deque()
+        last_id = start_after
+        while True:
+            cursor.execute('SELECT id FROM contacts WHERE id > ? ORDER BY id LIMIT ?', (last_id, chunk_contacts))
+            contact_ids = [row[0] for row in cursor.fetchall()]
+            if not contact_ids:
+                break
+            last_id = contact_ids[-1]
+            # Ordem (contato, id) pelo índice de contact_id: a ordem das transições é a de chegada
+            cursor.execute('''SELECT id, contact_id, message, sender, sentiment FROM messages
+                              WHERE contact_id BETWEEN ? AND ? ORDER BY contact_id, id''', (contact_ids[0], last_id))
+            rows = cursor.fetchall()
+            pending.append((contact_ids, rows, _submit_scoring(pool, [row[2] for row in rows])))
+            if len(pending) >= window:
+                write(*pending.popleft())
+            
+            now = time.perf_counter()
+            if now - last_report >= RESCORE_PROGRESS_INTERVAL:
+                last_report = now
+                rate = stats['mensagens'] / (now - started)
+                print(f"🔁 {stats['contatos']} contatos, {stats['mensagens']} mensagens ({rate * 3600:,.0f}/h)")
+                logging.info(f"Re-pontuação: {stats['contatos']} contatos, {stats['mensagens']} mensagens, {rate:.0f} mensagens/s")
+        while pending:
+            write(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    # Execução completa: a próxima começa do início
+    cursor.execute('DELETE FROM rescore_checkpoint')
+    commit(conn)
+    stats['segundos'] = time.perf_counter() - started
+    stats['mensagens_por_hora'] = stats['mensagens'] / stats['segundos'] * 3600 if stats['segundos'] else 0.0
+    logging.info(f"Re-pontuação concluída: {stats}")
+    return stats
+
+def add_contacts(cursor, conn, scheduler, contacts):
+    for name, industry, pain_point in contacts:
+        contact_id = update_contact(cursor, conn, name, industry, pain_point)
+        cursor.execute('SELECT lead_score, current_stage, last_interaction_ts FROM contacts WHERE id = ?', (contact_id,))
+        lead_score, stage, last_interaction_ts = cursor.fetchone()
+        scheduler.add(contact_id, name, lead_score, stage, last_interaction_ts,
+                      industry=industry, pain_point=pain_point)
+        follow_ups.shard.add(contact_id)
+    # A fila de follow-ups é recarregada com os contatos novos na próxima verificação
+    follow_ups.reset()
+
+def _receive_assignments(cursor, conn, scheduler, assignments, timeout=None):
+    # Registra os contatos redistribuídos pelo supervisor; com `timeout`, espera pelo primeiro lote.
+    # True quando o supervisor pede o encerramento (None na fila)
+    while assignments is not None:
+        try:
+            batch = assignments.get(timeout=timeout) if timeout else assignments.get_nowait()
+        except queue.Empty:
+            return False
+        if batch is None:
+            return True
+        add_contacts(cursor, conn, scheduler, batch)
+        timeout = None
+    return False
+
+def run_bot(transport, cursor, conn, contacts, product, cycles=None, assignments=None):
+    # `assignments` (opcional) é a fila por onde o supervisor entrega contatos redistribuídos
+    scheduler = ContactScheduler()
+    # Follow-ups só para os contatos desta sessão, não para todo o banco (ex.: uma importação inteira)
+    follow_ups.shard = set()
+    add_contacts(cursor, conn, scheduler, contacts)
+    seen_messages.load(cursor)
+    
+    if OUTBOX_ENABLED:
+        outbox.start(transport)
+    try:
+        cycle = 0
+        stopping = False
+        while not stopping and (cycles is None or cycle < cycles):
+            cycle += 1
+            stopping = _receive_assignments(cursor, conn, scheduler, assignments)
+            if stopping:
+                break
+            if not len(scheduler):
+                # Sessão sem contatos: espera uma redistribuição em vez de girar em ciclos vazios
+                if assignments is not None:
+                    stopping = _receive_assignments(cursor, conn, scheduler, assignments, timeout=SUPERVISOR_POLL_INTERVAL)
+                else:
+                    time.sleep(SUPERVISOR_POLL_INTERVAL)
+                continue
+            try:
+                with profile_cycle():
+                    # Cada ciclo atende todos os contatos uma vez, em ordem de prioridade
+                    for _ in range(len(scheduler)):
+                        stopping = _receive_assignments(cursor, conn, scheduler, assignments)
+                        if stopping:
+                            break
+                        
+                        for chat in transport.list_chats():
+                            if chat['unread']:
+                                scheduler.mark_unread_by_name(chat['name'])
+                        
+                        contact = scheduler.next()
+                        service_contact(transport, cursor, conn, scheduler, contact, product)
+                        transport.maintain()
+                        check_follow_ups(cursor, conn, transport, product)
+                        outbox.apply_results(cursor, conn)
+                        
+                        metrics.set_gauge('scheduler_queue_depth', scheduler.depth())
+                        metrics.set_gauge('outbox_pending', len(outbox))
+                        metrics.set_gauge('follow_up_contacts', len(follow_ups))
+                        metrics.set_gauge('sentiment_cache_size', len(_sentiment_cache))
+                        metrics.maybe_export()
+                    
+                    generate_analytics(cursor)
+                stats = scheduler.stats()
+                print(f"\n⏱️ Fila: {stats['fila']} (máx. {stats['fila_max']}) | Atendimentos: {stats['atendimentos']} | "
+                      f"1ª resposta: média {stats['resposta_media']:.1f}s, p95 {stats['resposta_p95']:.1f}s")
+                logging.info(f"Métricas do agendador: {stats}")
+                send_stats = send_timing_stats()['total']
+                print(f"📨 Envio: média {send_stats['media']:.1f}s, p95 {send_stats['p95']:.1f}s "
+                      f"({send_stats['envios']} envios, perfil {SEND_PROFILE})")
+            
+            except Exception as e:
+                logging.error(f"Erro no loop principal: {str(e)}")
+                transport.capture_error("main_loop")
+                print(f"\n⚠️ Erro no loop principal: {str(e)}. Continuando após 15 segundos...")
+                time.sleep(15)
+                continue
+    finally:
+        outbox.stop()
+        outbox.apply_results(cursor, conn)
+    return scheduler
+
+# Modo supervisor: N sessões em processos separados, cada uma com seu transporte e sua conexão
+# ao mesmo banco (WAL). Os contatos são divididos por hashing consistente do id, então a queda de
+# uma sessão só move os contatos dela para as sobreviventes.
+RING_REPLICAS = 64
+SESSIONS_DIR = 'chrome_sessions'
+MAIN_SESSION_DIR = os.path.join(SESSIONS_DIR, 'principal')  # perfil persistente: reinícios não pedem o QR code
+SUPERVISOR_POLL_INTERVAL = 1.0
+SUPERVISOR_SHUTDOWN_TIMEOUT = 45  # segundos para cada sessão terminar o atendimento e fechar o Chrome
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+    
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+    
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f'{node}#{replica}')
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+    
+    def remove(self, node):
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+    
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("Nenhuma sessão ativa no anel")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+    
+    def __len__(self):
+        return len(self._points) // self.replicas
+
+# Perfil do navegador: 'leve' usa janela pequena e não baixa imagens, mídia nem fontes (o bot só
+# lê texto); 'completo' é o navegador maximizado original. Headless exige o login já salvo no perfil.
+BROWSER_MODE = 'leve'
+BROWSER_HEADLESS = False
+BROWSER_WINDOW_SIZE = (1024, 768)
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.ogg', '*.opus', '*.mp3',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*pps.whatsapp.net*', '*mmg.whatsapp.net*', '*media*.whatsapp.net*',
+]
+
+def create_driver(user_data_dir=None, mode=None, headless=None):
+    _load_selenium()
+    mode = mode or BROWSER_MODE
+    headless = BROWSER_HEADLESS if headless is None else headless
     options = webdriver.ChromeOptions()
     options.add_argument("--disable-notifications")
-    options.add_argument("--start-maximized")
     options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    if mode == 'leve':
+        options.add_argument(f"--window-size={BROWSER_WINDOW_SIZE[0]},{BROWSER_WINDOW_SIZE[1]}")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--mute-audio")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    else:
+        options.add_argument("--start-maximized")
+    if headless:
+        options.add_argument("--headless=new")
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
     driver = webdriver.Chrome(options=options)
     
+    if mode == 'leve':
+        # Bloqueio por URL via CDP: as requisições nem chegam à rede
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    if headless:
+        # O WhatsApp Web recusa navegadores que se identificam como HeadlessChrome
+        user_agent = driver.execute_script('return navigator.userAgent').replace('HeadlessChrome', 'Chrome')
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', {'userAgent': user_agent})
+    return driver
+
+def wait_for_login(driver, timeout=120):
+    print("\n🔗 Acessando WhatsApp Web...")
+    started = time.time()
+    driver.get("https://web.whatsapp.com/")
+    WebDriverWait(driver, timeout).until(
+        EC.presence_of_element_located((By.XPATH, '//div[@aria-label="Lista de conversas"]'))
+    )
+    print(f"✅ Login realizado com sucesso! ({time.time() - started:.1f}s)")
+
+def open_browser(user_data_dir=None, login_timeout=120):
+    driver = create_driver(user_data_dir)
     try:
-        print("\n🔗 Acessando WhatsApp Web...")
-        driver.get("https://web.whatsapp.com/")
-        WebDriverWait(driver, 120).until(
-            EC.presence_of_element_located((By.XPATH, '//div[@aria-label="Lista de conversas"]'))
-        )
-        print("✅ Login realizado com sucesso!")
+        wait_for_login(driver, timeout=login_timeout)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+def process_tree_usage(pid):
+    # (RSS em bytes, CPU em segundos) do processo e de todos os descendentes, ou None se não houver como medir
+    if os.path.isdir('/proc'):
+        stats = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # Campos depois de "pid (nome) ": estado, ppid, ... utime (12º), stime (13º), rss em páginas (22º)
+            fields = data[data.rindex(')') + 2:].split()
+            stats[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]))
+        if pid not in stats:
+            return None
+        children = {}
+        for child, (parent, _, _) in stats.items():
+            children.setdefault(parent, []).append(child)
+        tree, pending = [], [pid]
+        while pending:
+            current = pending.pop()
+            tree.append(current)
+            pending.extend(children.get(current, []))
+        rss = sum(stats[member][2] for member in tree) * os.sysconf('SC_PAGE_SIZE')
+        cpu = sum(stats[member][1] for member in tree) / os.sysconf('SC_CLK_TCK')
+        return rss, cpu
+    try:
+        import psutil
+        root = psutil.Process(pid)
+        members = [root] + root.children(recursive=True)
+        rss = sum(member.memory_info().rss for member in members)
+        cpu = sum(sum(member.cpu_times()[:2]) for member in members)
+        return rss, cpu
+    except Exception:
+        return None
+
+# Ciclo de vida do navegador: o Chrome acumula memória ao longo de dias; o driver é recriado
+# (com o mesmo perfil, sem novo QR code) quando o RSS passa do limite ou após um intervalo fixo
+BROWSER_MAX_RSS_MB = 1500
+BROWSER_RECYCLE_INTERVAL = 12 * 3600
+BROWSER_CHECK_INTERVAL = 60
+
+class DriverLifecycle:
+    def __init__(self, factory, max_rss_mb=BROWSER_MAX_RSS_MB, interval=BROWSER_RECYCLE_INTERVAL,
+                 check_interval=BROWSER_CHECK_INTERVAL, clock=time.time):
+        self.factory = factory
+        self.max_rss_mb = max_rss_mb
+        self.interval = interval
+        self.check_interval = check_interval
+        self.clock = clock
+        self.driver = None
+        self.started = self._last_check = clock()
+        self.recycles = 0
+    
+    def start(self):
+        self.driver = self.factory()
+        self.started = self._last_check = self.clock()
+        return self.driver
+    
+    def usage(self):
+        process = getattr(getattr(self.driver, 'service', None), 'process', None)
+        return process_tree_usage(process.pid) if process is not None else None
+    
+    def maybe_recycle(self):
+        now = self.clock()
+        if self.driver is not None and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        if self.driver is None:
+            return self.recycle("nova tentativa após falha")
+        
+        reason = None
+        usage = self.usage()
+        if usage is not None:
+            rss_mb, cpu = usage[0] / 2 ** 20, usage[1]
+            metrics.set_gauge('browser_rss_mb', round(rss_mb, 1))
+            metrics.set_gauge('browser_cpu_seconds', round(cpu, 1))
+            if rss_mb > self.max_rss_mb:
+                reason = f"RSS {rss_mb:.0f} MB acima de {self.max_rss_mb} MB"
+        if reason is None and now - self.started >= self.interval:
+            reason = f"{(now - self.started) / 3600:.1f} h de uso"
+        return self.recycle(reason) if reason else False
+    
+    def recycle(self, reason):
+        logging.warning(f"Reciclando o navegador: {reason}")
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logging.error(f"Erro ao fechar o navegador antigo: {str(e)}")
+            self.driver = None
+        try:
+            self.start()
+        except Exception as e:
+            # Sem navegador, as operações falham e são tratadas como erro; tenta de novo na próxima checagem
+            logging.error(f"Falha ao reabrir o navegador: {str(e)}")
+            return True
+        self.recycles += 1
+        metrics.inc('browser_recycles')
+        return True
+    
+    def close(self):
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+def selenium_session(worker_id, contact_names):
+    # Um perfil do Chrome por sessão: o login (QR code) fica salvo entre execuções
+    lifecycle = DriverLifecycle(functools.partial(open_browser, os.path.join(SESSIONS_DIR, f'sessao_{worker_id}'), 300))
+    return SeleniumTransport(lifecycle.start(), lifecycle)
+
+def mock_session(worker_id, contact_names, **options):
+    return MockTransport(contact_names, seed=worker_id, **options)
+
+def _shard_worker(worker_id, db_path, contacts, contact_names, product, transport_factory, cycles, assignments, results):
+    global METRICS_FILE
+    METRICS_FILE = f'sales_bot.sessao_{worker_id}.prom'
+    # O listener de log do supervisor não existe no processo filho; cada sessão rotaciona o próprio arquivo
+    setup_logging(f'sales_bot.sessao_{worker_id}.log')
+    conn, cursor = connect_database(db_path)
+    # Toda sessão alcança qualquer contato; o shard só define quem ela atende
+    transport = transport_factory(worker_id, contact_names)
+    try:
+        scheduler = run_bot(transport, cursor, conn, [contact[1:] for contact in contacts], product,
+                            cycles=cycles, assignments=assignments)
+        results.put({'sessao': worker_id, **scheduler.stats(), 'contatos': len(scheduler),
+                     'recebidas': metrics.counters.get('messages_in', 0),
+                     'enviadas': metrics.counters.get('messages_out', 0)})
+    finally:
+        transport.close()
+        conn.close()
+        stop_logging()
+
+def run_supervisor(db_path, product, sessions, transport_factory=selenium_session, contacts=None, cycles=None):
+    conn, cursor = setup_database(db_path)
+    if contacts is None:
+        contacts = list(load_contacts(cursor))
+    contacts = [(update_contact(cursor, conn, name, industry, pain_point), name, industry, pain_point)
+                for name, industry, pain_point in contacts]
+    conn.close()
+    
+    contact_names = [name for _, name, _, _ in contacts]
+    ring = HashRing(range(sessions))
+    shards = {worker_id: [] for worker_id in range(sessions)}
+    for contact in contacts:
+        shards[ring.node_for(contact[0])].append(contact)
+    
+    results = multiprocessing.Queue()
+    workers, inboxes = {}, {}
+    for worker_id, shard in shards.items():
+        inboxes[worker_id] = multiprocessing.Queue()
+        workers[worker_id] = multiprocessing.Process(
+            target=_shard_worker, name=f'sessao-{worker_id}', daemon=True,
+            args=(worker_id, db_path, shard, contact_names, product, transport_factory, cycles, inboxes[worker_id], results))
+        workers[worker_id].start()
+        logging.info(f"Sessão {worker_id} iniciada (pid {workers[worker_id].pid}) com {len(shard)} contatos")
+    
+    summary = {'sessoes': [], 'redistribuidos': 0, 'falhas': 0}
+    try:
+        while workers:
+            multiprocessing.connection.wait([worker.sentinel for worker in workers.values()], SUPERVISOR_POLL_INTERVAL)
+            for worker_id, worker in list(workers.items()):
+                if worker.is_alive():
+                    continue
+                worker.join()
+                del workers[worker_id]
+                ring.remove(worker_id)
+                moved = shards.pop(worker_id)
+                if worker.exitcode == 0:
+                    continue
+                
+                summary['falhas'] += 1
+                logging.error(f"Sessão {worker_id} terminou com código {worker.exitcode}; redistribuindo {len(moved)} contatos")
+                if not workers:
+                    logging.error(f"Nenhuma sessão ativa para assumir {len(moved)} contatos")
+                    break
+                reassigned = {}
+                for contact in moved:
+                    reassigned.setdefault(ring.node_for(contact[0]), []).append(contact)
+                for target, batch in reassigned.items():
+                    shards[target].extend(batch)
+                    inboxes[target].put([contact[1:] for contact in batch])
+                summary['redistribuidos'] += len(moved)
+            
+            while True:
+                try:
+                    summary['sessoes'].append(results.get_nowait())
+                except queue.Empty:
+                    break
+    finally:
+        # Encerramento pela fila de cada sessão: ela termina o contato atual e fecha o transporte
+        # (Chrome e chromedriver); terminate() só para quem não sair a tempo
+        for worker_id in workers:
+            inboxes[worker_id].put(None)
+        deadline = time.time() + SUPERVISOR_SHUTDOWN_TIMEOUT
+        for worker in workers.values():
+            worker.join(max(0.0, deadline - time.time()))
+        for worker_id, worker in workers.items():
+            if worker.is_alive():
+                logging.warning(f"Sessão {worker_id} não encerrou em {SUPERVISOR_SHUTDOWN_TIMEOUT}s; forçando a saída")
+                worker.terminate()
+                worker.join()
+    
+    while True:
+        try:
+            summary['sessoes'].append(results.get(timeout=0.1))
+        except queue.Empty:
+            break
+    summary['sessoes'].sort(key=lambda stats: stats['sessao'])
+    logging.info(f"Supervisor encerrado: {summary}")
+    return summary
+
+def main():
+    conn, cursor = setup_database()
+    
+    lifecycle = DriverLifecycle(functools.partial(open_browser, MAIN_SESSION_DIR))
+    transport = None
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    
+    try:
+        transport = SeleniumTransport(lifecycle.start(), lifecycle)
         
         product = input("\n📝 Qual produto/serviço você está vendendo? (Ex: Ebook de Marketing Digital): ").strip()
         if not product:
@@ -442,6 +2976,12 @@ def main():
         if input("\n🧠 Deseja adicionar novos scripts de resposta? (s/n): ").lower() == 's':
             train_ai(cursor, conn)
         
+        imported = []
+        import_path = input("\n📂 Arquivo CSV/JSONL para importar contatos (Enter para pular): ").strip()
+        if import_path:
+            stats = import_contacts(conn, import_path, names=imported)
+            print(f"✅ {stats['lidos']} linhas lidas, {stats['gravados']} contatos novos ou atualizados")
+        
         print("\n👥 Cadastro de Contatos (digite 'sair' para terminar):")
         print("Formato: Nome;Indústria;Ponto de Dor")
         print("Exemplo: João Silva;Varejo;Falta de clientes")
@@ -459,53 +2999,128 @@ def main():
                 if name:
                     contacts.append((name, industry, pain_point))
         
+        if imported:
+            typed = {name for name, _, _ in contacts}
+            contacts.extend(contact for contact in load_contacts(cursor, imported) if contact[0] not in typed)
+        
         if not contacts:
             print("⚠️ Nenhum contato cadastrado. Encerrando...")
             return
         
         print("\n🤖 Iniciando atendimento automático...")
-        while True:
-            try:
-                for name, industry, pain_point in contacts:
-                    contact_id = update_contact(cursor, conn, name, industry, pain_point)
-                    
-                    cursor.execute('SELECT initial_message_sent FROM contacts WHERE id = ?', (contact_id,))
-                    initial_sent = cursor.fetchone()[0]
-                    
-                    if not initial_sent:
-                        response, script_id = get_sales_script(cursor, 'oi', 'prospecção', contact_id, name, product, pain_point, industry)
-                        if response:
-                            if send_message(driver, cursor, conn, contact_id, name, response):
-                                cursor.execute('UPDATE contacts SET initial_message_sent = 1, last_interaction = ? WHERE id = ?',
-                                               (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), contact_id))
-                                conn.commit()
-                                logging.info(f"Mensagem inicial enviada para {name}")
-                    
-                    if read_messages(driver, cursor, conn, contact_id, name, product, pain_point, industry):
-                        time.sleep(15)
-                    
-                    check_follow_ups(cursor, conn, driver, product)
-                    
-                    time.sleep(7)
-                
-                generate_analytics(cursor)
-                time.sleep(10)  # Pausa entre ciclos, sem entrada do usuário
-            
-            except Exception as e:
-                logging.error(f"Erro no loop principal: {str(e)}")
-                driver.save_screenshot(f"erro_main_loop_{int(time.time())}.png")
-                print(f"\n⚠️ Erro no loop principal: {str(e)}. Continuando após 15 segundos...")
-                time.sleep(15)
-                continue
+        run_bot(transport, cursor, conn, contacts, product)
         
     except Exception as e:
         print(f"\n❌ Erro durante a execução: {str(e)}")
         logging.error(f"Erro principal: {str(e)}")
-        driver.save_screenshot(f"erro_main_{int(time.time())}.png")
+        if transport is not None:
+            transport.capture_error("main")
     finally:
-        driver.quit()
+        if transport is not None:
+            transport.close()
         conn.close()
         print("\n✅ Programa encerrado. Navegador e banco de dados fechados.")
 
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Bot de vendas para WhatsApp Web")
+    subcommands = parser.add_subparsers(dest='command')
+    export = subcommands.add_parser('exportar', help="exporta o relatório de contatos em CSV ou JSONL")
+    export.add_argument('arquivo')
+    export.add_argument('--formato', choices=['csv', 'jsonl'], default='csv')
+    importer = subcommands.add_parser('importar', help="importa contatos de um arquivo CSV (Nome;Indústria;Ponto de Dor) ou JSONL")
+    importer.add_argument('arquivo')
+    importer.add_argument('--lote', type=int, default=IMPORT_CHUNK_SIZE, help="contatos gravados por transação")
+    supervisor = subcommands.add_parser('supervisor', help="atende os contatos do banco com várias sessões em paralelo")
+    supervisor.add_argument('--sessoes', type=int, default=2)
+    supervisor.add_argument('--produto', default="Ebook de Marketing Digital")
+    supervisor.add_argument('--ciclos', type=int, default=None)
+    supervisor.add_argument('--simulado', action='store_true', help="usa o transporte simulado em vez do Chrome")
+    archiver = subcommands.add_parser('arquivar', help=f"move mensagens antigas para {ARCHIVE_DB}")
+    archiver.add_argument('--dias', type=int, default=ARCHIVE_AFTER_DAYS, help="idade mínima das mensagens arquivadas")
+    archiver.add_argument('--compactar', action='store_true', help="compacta o banco principal depois de arquivar")
+    search = subcommands.add_parser('buscar', help="busca mensagens no banco principal e no arquivo")
+    search.add_argument('texto')
+    search.add_argument('--contato', help="nome do contato")
+    search.add_argument('--limite', type=int, default=SEARCH_LIMIT)
+    rescore = subcommands.add_parser('repontuar', help="recalcula sentimentos, estágios e lead scores a partir do histórico")
+    rescore.add_argument('--processos', type=int, default=None, help="processos de cálculo (padrão: um por CPU)")
+    rescore.add_argument('--lote', type=int, default=RESCORE_CHUNK_CONTACTS, help="contatos por transação")
+    rescore.add_argument('--reiniciar', action='store_true', help="ignora o checkpoint de uma execução interrompida")
+    args = parser.parse_args(argv)
+    
+    if args.command == 'exportar':
+        conn, cursor = setup_database()
+        try:
+            total = export_report(cursor, args.arquivo, args.formato)
+            print(f"✅ {total} contatos exportados para {args.arquivo}")
+        finally:
+            conn.close()
+        return
+    if args.command == 'importar':
+        conn, cursor = setup_database()
+        try:
+            stats = import_contacts(conn, args.arquivo, args.lote)
+            print(f"✅ {stats['lidos']} linhas lidas, {stats['gravados']} contatos novos ou atualizados, {stats['ignorados']} sem nome")
+        finally:
+            conn.close()
+        return
+    if args.command == 'arquivar':
+        conn, cursor = setup_database()
+        archive = open_archive()
+        try:
+            stats = archive_messages(conn, archive, args.dias)
+            print(f"✅ {stats['mensagens']} mensagens arquivadas em {stats['segmentos']} segmentos")
+            if args.compactar:
+                compact_database(conn)
+                print("✅ Banco principal compactado")
+        finally:
+            archive.close()
+            conn.close()
+        return
+    if args.command == 'buscar':
+        conn, cursor = setup_database()
+        archive = open_archive() if os.path.exists(ARCHIVE_DB) else None
+        try:
+            contact_id = None
+            if args.contato:
+                cursor.execute('SELECT id FROM contacts WHERE name = ?', (args.contato,))
+                row = cursor.fetchone()
+                if row is None:
+                    print(f"Contato {args.contato} não encontrado")
+                    return
+                contact_id = row[0]
+            for found in search_messages(cursor, args.texto, contact_id, args.limite, archive):
+                print(f"[{found['timestamp']}] {'📦 ' if found['arquivada'] else ''}{found['sender']} "
+                      f"(contato {found['contact_id']}): {found['message']}")
+        finally:
+            if archive is not None:
+                archive.close()
+            conn.close()
+        return
+    if args.command == 'repontuar':
+        conn, cursor = setup_database()
+        # As mensagens arquivadas entram no histórico dos contatos
+        archive = open_archive() if os.path.exists(ARCHIVE_DB) else None
+        try:
+            stats = rescore_messages(conn, args.processos, args.lote, args.reiniciar, archive)
+            print(f"✅ {stats['mensagens']} mensagens ({stats['alteradas']} com novo sentimento) e {stats['contatos']} contatos "
+                  f"({stats['contatos_alterados']} atualizados) em {stats['segundos']:.1f}s "
+                  f"({stats['mensagens_por_hora']:,.0f} mensagens/h)")
+            generate_analytics(cursor)
+        finally:
+            if archive is not None:
+                archive.close()
+            conn.close()
+        return
+    if args.command == 'supervisor':
+        summary = run_supervisor('whatsapp_sales.db', args.produto, args.sessoes,
+                                 mock_session if args.simulado else selenium_session, cycles=args.ciclos)
+        for stats in summary['sessoes']:
+            print(f"Sessão {stats['sessao']}: {stats['contatos']} contatos, {stats['atendimentos']} atendimentos, "
+                  f"{stats['recebidas']} recebidas, {stats['enviadas']} enviadas")
+        print(f"✅ {summary['falhas']} falhas, {summary['redistribuidos']} contatos redistribuídos")
+        return
+    main()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
@@ -0,0 +1,858 @@
+import sys
+import os
+import time
+import re
+import random
+import hashlib
+import itertools
+import sqlite3
+import tempfile
+import io
+import contextlib
+import tracemalloc
+import functools
+import logging
+import zlib
+import struct
+import subprocess
+import threading
+from datetime import datetime, timedelta
+
+import IAVendas
+
+SAMPLE_MESSAGES = [
+    'oi', 'olá, tudo bem?', 'quero comprar agora', 'achei caro', 'não tenho tempo',
+    'me explique melhor', 'ok', 'qual o preço?', 'interessado!', 'pare de mandar mensagem',
+    'Prezado, gostaria de mais detalhes sobre o material. Atenciosamente, Carlos',
+    'haha legal 😄', 'pode mostrar como funciona?', 'talvez depois', 'show, adoraria saber mais'
+]
+STAGES = ['prospecção', 'nurturing', 'objeção', 'fechamento', 'follow-up']
+
+def _timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def _report(name, baseline, optimized, count):
+    print(f"{name}: antes {baseline:.3f}s ({count / baseline:,.0f}/s) | "
+          f"depois {optimized:.3f}s ({count / optimized:,.0f}/s) | {baseline / optimized:.1f}x")
+
+# Caminho original: consulta SQL + re.search compilado por linha a cada chamada
+def _legacy_get_sales_script(cursor, message, stage, contact_id, contact_name, product, pain_point=None, industry=None):
+    message_lower = message.lower()
+    user_tone = IAVendas.detect_user_tone(message)
+    cursor.execute('SELECT response, id, keyword, tone FROM sales_scripts WHERE stage = ?', (stage,))
+    for response, script_id, keyword, tone in cursor.fetchall():
+        if re.search(rf'\b{keyword}\b', message_lower) and tone in (user_tone, 'profissional'):
+            benefit = f"técnicas para superar {pain_point}" if pain_point else "resultados rápidos"
+            return response.format(contact_name=contact_name, product=product, benefit=benefit,
+                                   pain_point=pain_point or "seus desafios", industry=industry or "seu setor"), script_id
+    return None, None
+
+def bench_scripts(count=20000):
+    count = int(count)
+    conn, cursor = IAVendas.setup_database(':memory:')
+    rng = random.Random(42)
+    workload = [(rng.choice(SAMPLE_MESSAGES), rng.choice(STAGES)) for _ in range(count)]
+
+    def run(func):
+        return [func(cursor, msg, stage, 1, 'Ana', 'Ebook', 'falta de clientes', 'varejo')[1] for msg, stage in workload]
+
+    baseline, expected = _timeit(run, _legacy_get_sales_script)
+    IAVendas.invalidate_script_index()
+    optimized, got = _timeit(run, IAVendas.get_sales_script)
+    assert expected == got, "índice de scripts divergiu do caminho original"
+    _report("get_sales_script", baseline, optimized, count)
+    conn.close()
+
+# Caminho original: TextBlob sempre construído antes das regexes, sem cache
+def _legacy_analyze_sentiment(message):
+    from textblob import TextBlob
+    polarity = TextBlob(message).sentiment.polarity
+    message_lower = message.lower()
+    if re.search(r'\b(quero|comprar|interessado|show|legal|ótimo|valeu|adoraria)\b', message_lower):
+        return "Positivo"
+    if re.search(r'\b(não|caro|pare|stop|desinteressado)\b', message_lower):
+        return "Negativo"
+    if re.search(r'\b(saber|explicar|como|qual|detalhes|mostrar|me explique)\b', message_lower):
+        return "Curioso"
+    if polarity > 0.3:
+        return "Positivo"
+    elif polarity < -0.3:
+        return "Negativo"
+    elif 0.1 < polarity <= 0.3:
+        return "Curioso"
+    elif -0.3 <= polarity < -0.1:
+        return "Hesitante"
+    return "Neutro"
+
+def bench_sentiment(count=20000):
+    count = int(count)
+    rng = random.Random(42)
+    # Mistura de mensagens recebidas variadas e templates fixos enviados pelo bot
+    conn, cursor = IAVendas.setup_database(':memory:')
+    templates = [IAVendas.get_sales_script(cursor, msg, stage, 1, 'Ana', 'Ebook')[0]
+                 for msg, stage in [('oi', 'prospecção'), ('ok', 'nurturing'), ('caro', 'objeção'), ('quero', 'fechamento')]]
+    workload = [rng.choice(SAMPLE_MESSAGES + templates) + (f' {rng.randint(0, 500)}' if rng.random() < 0.3 else '')
+                for _ in range(count)]
+
+    baseline, expected = _timeit(lambda: [_legacy_analyze_sentiment(m) for m in workload])
+    IAVendas.clear_sentiment_cache()
+    optimized, got = _timeit(lambda: [IAVendas.analyze_sentiment(m) for m in workload])
+    assert expected == got, "análise de sentimento divergiu do caminho original"
+    _report("analyze_sentiment", baseline, optimized, count)
+    IAVendas.clear_sentiment_cache()
+    batch, _ = _timeit(IAVendas.analyze_sentiment_batch, workload)
+    _report("analyze_sentiment_batch", baseline, batch, count)
+    print(f"cache: {IAVendas.sentiment_cache_info()}")
+    conn.close()
+
+LEGACY_SCHEMA = [
+    '''CREATE TABLE contacts (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, last_interaction TEXT,
+       lead_score INTEGER DEFAULT 50, engagement_level TEXT, current_stage TEXT)''',
+    '''CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, contact_id INTEGER, message TEXT NOT NULL,
+       sender TEXT NOT NULL, timestamp TEXT NOT NULL, sentiment TEXT, message_hash TEXT, context_summary TEXT)''',
+]
+
+def _fill_messages(conn, total, contacts, wa_ids=False):
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany('INSERT INTO contacts (name, last_interaction) VALUES (?, ?)',
+                     ((f'Contato {i}', now) for i in range(contacts)))
+    if wa_ids:
+        conn.executemany('''INSERT INTO messages (contact_id, message, wa_id, sender, timestamp, sentiment)
+                            VALUES (?, ?, ?, 'user', ?, 'Neutro')''',
+                         ((i % contacts + 1, f'mensagem {i}', f'wamid.{i}', now) for i in range(total)))
+    else:
+        conn.executemany('''INSERT INTO messages (contact_id, message, message_hash, sender, timestamp, sentiment)
+                            VALUES (?, ?, ?, 'user', ?, 'Neutro')''',
+                         ((i % contacts + 1, f'mensagem {i}', hashlib.sha256(f'mensagem {i}'.encode()).hexdigest(), now)
+                          for i in range(total)))
+    conn.commit()
+
+# Escritas de uma mensagem recebida no caminho original: SELECT + INSERT + UPDATE, com commit a cada comando
+def _legacy_message_writes(conn, cursor, contact_id, text):
+    message_hash = hashlib.sha256(text.encode()).hexdigest()
+    cursor.execute('SELECT id FROM messages WHERE contact_id = ? AND message_hash = ?', (contact_id, message_hash))
+    if not cursor.fetchone():
+        cursor.execute('''INSERT INTO messages (contact_id, message, message_hash, sender, timestamp, sentiment)
+                          VALUES (?, ?, ?, 'user', ?, 'Positivo')''', (contact_id, text, message_hash, time.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    cursor.execute('UPDATE contacts SET engagement_level = ?, current_stage = ? WHERE id = ?', ('positivo', 'nurturing', contact_id))
+    conn.commit()
+    cursor.execute('UPDATE contacts SET lead_score = lead_score + 15 WHERE id = ?', (contact_id,))
+    conn.commit()
+
+def _optimized_message_writes(conn, cursor, contact_id, text):
+    with IAVendas.write_batch(conn):
+        if IAVendas.log_message(cursor, conn, contact_id, text, 'user', 'Positivo', f'wamid.{text}'):
+            cursor.execute('UPDATE contacts SET engagement_level = ?, current_stage = ? WHERE id = ?', ('positivo', 'nurturing', contact_id))
+            cursor.execute('UPDATE contacts SET lead_score = lead_score + 15 WHERE id = ?', (contact_id,))
+
+def bench_storage(total=1_000_000, contacts=1000, writes=300, lookups=300):
+    total = int(total)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for variant in ('antes', 'depois'):
+            path = os.path.join(tmp, f'{variant}.db')
+            if variant == 'antes':
+                conn = sqlite3.connect(path)
+                for statement in LEGACY_SCHEMA:
+                    conn.execute(statement)
+                write = _legacy_message_writes
+            else:
+                conn, _ = IAVendas.setup_database(path)
+                write = _optimized_message_writes
+            cursor = conn.cursor()
+            start = time.perf_counter()
+            _fill_messages(conn, total, contacts, wa_ids=variant == 'depois')
+            fill = time.perf_counter() - start
+
+            # Busca de deduplicação: por hash do texto antes, por id do WhatsApp depois
+            rng = random.Random(7)
+            if variant == 'antes':
+                query = 'SELECT id FROM messages WHERE contact_id = ? AND message_hash = ?'
+                probes = [hashlib.sha256(f'mensagem {rng.randrange(total)}'.encode()).hexdigest() for _ in range(lookups)]
+            else:
+                query = 'SELECT id FROM messages WHERE contact_id = ? AND wa_id = ?'
+                probes = [f'wamid.{rng.randrange(total)}' for _ in range(lookups)]
+            start = time.perf_counter()
+            for key in probes:
+                cursor.execute(query, (rng.randrange(contacts) + 1, key))
+                cursor.fetchone()
+            lookup = (time.perf_counter() - start) / lookups
+
+            start = time.perf_counter()
+            for i in range(writes):
+                write(conn, cursor, i % contacts + 1, f'nova mensagem {i}')
+            insert_rate = writes / (time.perf_counter() - start)
+            results[variant] = (fill, lookup, insert_rate)
+            conn.close()
+
+    for variant, (fill, lookup, insert_rate) in results.items():
+        print(f"storage {variant}: carga de {total:,} mensagens em {fill:.1f}s | "
+              f"busca de duplicata {lookup * 1000:.3f} ms | {insert_rate:,.0f} mensagens gravadas/s")
+
+def _synthetic_arrivals(contacts, duration, rng):
+    # 10% de leads quentes (uma mensagem a cada ~30 min) e o resto esporádico (~6 h)
+    arrivals = []
+    for contact_id in range(contacts):
+        mean_gap = 1800 if rng.random() < 0.1 else 6 * 3600
+        t = rng.expovariate(1 / mean_gap)
+        while t < duration:
+            arrivals.append((t, contact_id))
+            t += rng.expovariate(1 / mean_gap)
+    arrivals.sort()
+    return arrivals
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[int(len(values) * fraction)] if values else 0.0
+
+def bench_scheduler(contacts=1000, duration=4 * 3600, busy_cost=8, idle_cost=3):
+    contacts = int(contacts)
+    rng = random.Random(11)
+    arrivals = _synthetic_arrivals(contacts, duration, rng)
+    results = {}
+
+    # Laço original: cada contato em ordem, um por vez
+    now, cursor_pos, pending, waits, max_depth = 0.0, 0, {}, [], 0
+    while now < duration:
+        for contact_id in range(contacts):
+            while cursor_pos < len(arrivals) and arrivals[cursor_pos][0] <= now:
+                t, cid = arrivals[cursor_pos]
+                pending.setdefault(cid, t)
+                cursor_pos += 1
+            max_depth = max(max_depth, len(pending))
+            first_arrival = pending.pop(contact_id, None)
+            now += busy_cost if first_arrival is not None else idle_cost
+            if first_arrival is not None:
+                waits.append(now - first_arrival)
+            if now >= duration:
+                break
+    results['sequencial'] = (waits, max_depth)
+
+    # Agendador por prioridade com relógio simulado
+    clock = [0.0]
+    scheduler = IAVendas.ContactScheduler(clock=lambda: clock[0])
+    for contact_id in range(contacts):
+        scheduler.add(contact_id, f'Contato {contact_id}', lead_score=rng.randint(0, 100),
+                      stage=rng.choice(list(IAVendas.STAGE_PRIORITY)))
+    cursor_pos, waits = 0, []
+    while clock[0] < duration:
+        while cursor_pos < len(arrivals) and arrivals[cursor_pos][0] <= clock[0]:
+            t, cid = arrivals[cursor_pos]
+            scheduler.mark_unread(cid, now=t)
+            cursor_pos += 1
+        contact = scheduler.next()
+        busy = contact['unread_since'] is not None
+        clock[0] += busy_cost if busy else idle_cost
+        if busy:
+            waits.append(clock[0] - contact['unread_since'])
+        scheduler.done(contact['id'], busy)
+    results['prioridade'] = (waits, scheduler.stats()['fila_max'])
+
+    print(f"scheduler: {contacts} contatos, {len(arrivals)} mensagens em {duration / 3600:.0f}h simuladas")
+    for name, (waits, max_depth) in results.items():
+        mean = sum(waits) / len(waits) if waits else 0.0
+        print(f"  {name}: 1ª resposta média {mean:,.0f}s, p95 {_percentile(waits, 0.95):,.0f}s | "
+              f"respondidas {len(waits)} | fila máx. {max_depth}")
+
+def bench_pipeline(contacts=1000, cycles=3):
+    # Pipeline completo (agendador, leitura, sentimento, scripts, SQLite, envio) sobre o transporte simulado
+    contacts, cycles = int(contacts), int(cycles)
+    IAVendas.SEND_PROFILE = 'rápido'
+    IAVendas.CONTACT_TIME_SLICE, IAVendas.IDLE_TIME_SLICE = 0.2, 0.01
+    names = [f'Contato {i}' for i in range(contacts)]
+    transport = IAVendas.MockTransport(names, reply_probability=0.7, reply_delay=(0.0, 0.02), fetch_wait=0.005, seed=5)
+    rng = random.Random(5)
+    for name in rng.sample(names, contacts // 3):
+        transport.schedule_message(name, rng.choice(SAMPLE_MESSAGES), rng.uniform(0, 2))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, cursor = IAVendas.setup_database(os.path.join(tmp, 'pipeline.db'))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            scheduler = IAVendas.run_bot(transport, cursor, conn, [(name, 'varejo', 'falta de clientes') for name in names],
+                                         'Ebook', cycles=cycles)
+        elapsed = time.perf_counter() - start
+        conn.close()
+
+    sent = sum(len(messages) for messages in transport.sent.values())
+    latencies = transport.reply_latencies
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    print(f"pipeline: {contacts} contatos, {cycles} ciclos em {elapsed:.1f}s | {transport.delivered} recebidas, "
+          f"{sent} enviadas ({(transport.delivered + sent) / elapsed:,.0f} mensagens/s) | "
+          f"resposta média {mean * 1000:.0f} ms, p95 {_percentile(latencies, 0.95) * 1000:.0f} ms | "
+          f"atendimentos {scheduler.stats()['atendimentos']}")
+
+class _AllAnswered(BaseException):
+    pass
+
+class _TypingTransport(IAVendas.MockTransport):
+    # Envio que demora proporcionalmente ao tamanho do texto, como a digitação no navegador;
+    # encerra o bot quando todas as mensagens agendadas foram entregues e respondidas
+    def __init__(self, contact_names, char_seconds, **options):
+        super().__init__(contact_names, reply_probability=0.0, **options)
+        self.char_seconds = char_seconds
+    
+    def send(self, contact_name, text):
+        time.sleep(len(text) * self.char_seconds)
+        return super().send(contact_name, text)
+    
+    def list_chats(self):
+        with self._lock:
+            if not any(self._inbox.values()) and not self._waiting_since:
+                raise _AllAnswered()
+        return super().list_chats()
+
+def _outbox_run(enabled, contacts, per_contact, window, char_seconds):
+    IAVendas.OUTBOX_ENABLED = enabled
+    names = [f'Contato {i}' for i in range(contacts)]
+    transport = _TypingTransport(names, char_seconds, fetch_wait=0.005)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, cursor = IAVendas.setup_database(os.path.join(tmp, 'outbox.db'))
+        # Só conversas em andamento: sem mensagens iniciais de prospecção
+        for name in names:
+            IAVendas.update_contact(cursor, conn, name, 'varejo', 'falta de clientes')
+        cursor.execute('UPDATE contacts SET initial_message_sent = 1')
+        conn.commit()
+        rng = random.Random(9)
+        for name in names:
+            for _ in range(per_contact):
+                transport.schedule_message(name, rng.choice(SAMPLE_MESSAGES), rng.uniform(0, window))
+        
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                IAVendas.run_bot(transport, cursor, conn, [(name, 'varejo', 'falta de clientes') for name in names], 'Ebook')
+        except _AllAnswered:
+            pass
+        elapsed = time.perf_counter() - start
+        cursor.execute("SELECT COUNT(*) FROM messages WHERE sender = 'bot'")
+        logged = cursor.fetchone()[0]
+        conn.close()
+    sent = sum(len(messages) for messages in transport.sent.values())
+    return elapsed, transport.reply_latencies, sent, logged
+
+def bench_outbox(contacts=20, per_contact=3, window=5, char_ms=0.5):
+    # Latência da chegada da mensagem até a resposta, com o envio na thread da leitura e com a fila de saída
+    contacts, per_contact, window, char_seconds = int(contacts), int(per_contact), float(window), float(char_ms) / 1000
+    IAVendas.SEND_PROFILE = 'rápido'
+    IAVendas.CONTACT_TIME_SLICE, IAVendas.IDLE_TIME_SLICE = 0.3, 0.01
+    enabled = IAVendas.OUTBOX_ENABLED
+    try:
+        for label, flag in (('antes', False), ('depois', True)):
+            coalesced = IAVendas.metrics.counters.get('sends_coalesced', 0)
+            elapsed, latencies, sent, logged = _outbox_run(flag, contacts, per_contact, window, char_seconds)
+            coalesced = IAVendas.metrics.counters.get('sends_coalesced', 0) - coalesced
+            print(f"outbox [{label}]: {contacts * per_contact} mensagens de {contacts} contatos em {elapsed:.1f}s | "
+                  f"resposta p50 {_percentile(latencies, 0.5) * 1000:.0f} ms, p95 {_percentile(latencies, 0.95) * 1000:.0f} ms, "
+                  f"máx {max(latencies, default=0) * 1000:.0f} ms | {sent} envios ({coalesced} respostas juntadas), "
+                  f"{logged} gravados no banco")
+    finally:
+        IAVendas.OUTBOX_ENABLED = enabled
+
+def _file_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+def _fill_history(conn, total, contacts, days, rng):
+    # Mensagens espalhadas pelos últimos `days` dias, em ordem de id, com um vocabulário de cauda longa
+    now = time.time()
+    conn.executemany('INSERT INTO contacts (name) VALUES (?)', ((f'Contato {i}',) for i in range(contacts)))
+    vocabulary = [f'termo{k}' for k in range(5000)]
+    rows = []
+    for i in range(total):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now - days * 86400 * (1 - i / total)))
+        words = ' '.join(vocabulary[min(int(rng.paretovariate(1.2)) - 1, len(vocabulary) - 1)] for _ in range(3))
+        extra = ' quero reembolso' if rng.random() < 0.001 else ''
+        rows.append((i % contacts + 1, f'{rng.choice(SAMPLE_MESSAGES)} {words}{extra}', f'wamid.{i}', stamp))
+        if len(rows) == 10000:
+            conn.executemany("INSERT INTO messages (contact_id, message, wa_id, sender, timestamp, sentiment) VALUES (?, ?, ?, 'user', ?, 'Neutro')", rows)
+            rows = []
+    conn.executemany("INSERT INTO messages (contact_id, message, wa_id, sender, timestamp, sentiment) VALUES (?, ?, ?, 'user', ?, 'Neutro')", rows)
+    conn.commit()
+
+def bench_archive(total=300_000, contacts=1000, days=180, keep=30, queries=50):
+    # Busca no histórico: varredura com LIKE no banco inteiro vs. FTS5 no banco principal + arquivo comprimido
+    total, contacts, days, keep, queries = int(total), int(contacts), int(days), int(keep), int(queries)
+    rng = random.Random(19)
+    terms = ['reembolso'] + [f'termo{rng.randrange(50, 5000)}' for _ in range(queries - 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'historico.db')
+        conn, cursor = IAVendas.setup_database(path)
+        _fill_history(conn, total, contacts, days, rng)
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_before = _file_size(path)
+        
+        columns = ', '.join(IAVendas.ARCHIVE_COLUMNS)
+        baseline = []
+        for term in terms:
+            elapsed, _ = _timeit(lambda: cursor.execute(f'SELECT {columns} FROM messages WHERE message LIKE ? ORDER BY id DESC LIMIT ?',
+                                                        (f'%{term}%', IAVendas.SEARCH_LIMIT)).fetchall())
+            baseline.append(elapsed)
+        cursor.execute("SELECT COUNT(*) FROM messages WHERE message LIKE '%reembolso%'")
+        expected = cursor.fetchone()[0]
+        # Últimas mensagens arquivadas de cada contato: as que o observer relê numa conversa parada
+        cutoff = (datetime.now() - timedelta(days=keep)).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('SELECT contact_id, wa_id, message FROM messages WHERE timestamp < ? ORDER BY id DESC LIMIT ?',
+                       (cutoff, contacts))
+        latest = cursor.fetchall()
+        
+        # Palavras comuns casam com boa parte do histórico: a busca não pode ordenar todos os resultados
+        common = {}
+        sorted_query = f'''SELECT m.{", m.".join(IAVendas.ARCHIVE_COLUMNS)} FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                           WHERE messages_fts MATCH ? ORDER BY m.id DESC LIMIT ?'''
+        for word in ('quero', 'ok'):
+            before, expected_rows = _timeit(lambda: cursor.execute(sorted_query, (word, IAVendas.SEARCH_LIMIT)).fetchall())
+            after, rows = _timeit(IAVendas.search_messages, cursor, word)
+            assert [row['id'] for row in rows] == [row[0] for row in expected_rows], f"ordem diferente para '{word}'"
+            common[word] = (before, after)
+        
+        archive_path = os.path.join(tmp, 'arquivo.db')
+        archive = IAVendas.open_archive(archive_path)
+        start = time.perf_counter()
+        stats = IAVendas.archive_messages(conn, archive, keep)
+        IAVendas.compact_database(conn)
+        archived_in = time.perf_counter() - start
+        archive.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_after, archive_size = _file_size(path), _file_size(archive_path)
+        
+        optimized = []
+        for term in terms:
+            IAVendas._segment_cache.clear()  # sem cache: cada busca descomprime os segmentos que usa
+            elapsed, _ = _timeit(IAVendas.search_messages, cursor, term, None, IAVendas.SEARCH_LIMIT, archive)
+            optimized.append(elapsed)
+        found = len(IAVendas.search_messages(cursor, 'reembolso', limit=total, archive=archive))
+        
+        # O observer relê as últimas mensagens de conversas paradas: ids arquivados não podem voltar como novos
+        cursor.execute('SELECT COUNT(*) FROM archived_wa_ids')
+        kept_ids = cursor.fetchone()[0]
+        warmup, _ = _timeit(IAVendas.seen_messages.load, cursor)
+        seen = sum(IAVendas.seen_messages.seen(contact_id, wa_id) for contact_id, wa_id, _ in latest)
+        IAVendas.seen_messages.reset()
+        reingested = sum(IAVendas.log_message(cursor, conn, contact_id, message, 'user', 'Neutro', wa_id)
+                         for contact_id, wa_id, message in latest)
+        assert reingested == 0, f"{reingested} mensagens arquivadas gravadas de novo"
+        archive.close()
+        conn.close()
+    
+    print(f"archive: {total:,} mensagens em {days} dias | {stats['mensagens']:,} arquivadas em {stats['segmentos']} segmentos "
+          f"em {archived_in:.1f}s | banco principal {size_before / 2 ** 20:.1f} MiB -> {size_after / 2 ** 20:.1f} MiB, "
+          f"arquivo {archive_size / 2 ** 20:.1f} MiB")
+    print(f"archive: busca ({queries} termos) antes p50 {_percentile(baseline, 0.5) * 1000:.1f} ms, "
+          f"p95 {_percentile(baseline, 0.95) * 1000:.1f} ms | depois p50 {_percentile(optimized, 0.5) * 1000:.2f} ms, "
+          f"p95 {_percentile(optimized, 0.95) * 1000:.2f} ms | 'reembolso': {found} de {expected} encontradas")
+    print("archive: palavras comuns no banco principal (ORDER BY m.id -> rowid do FTS): " + ", ".join(
+        f"'{word}' {before * 1000:.1f} ms -> {after * 1000:.2f} ms" for word, (before, after) in common.items()))
+    print(f"archive: {kept_ids:,} ids arquivados mantidos (máx. {IAVendas.SEEN_WINDOW} por contato), aquecimento em "
+          f"{warmup * 1000:.0f} ms | reingestão de {len(latest)} ids arquivados: {seen} reconhecidos no aquecimento, "
+          f"{reingested} gravados de novo")
+
+def bench_rescore(total=500_000, contacts=10_000, processes=0):
+    # Re-pontuação completa do histórico: cálculo na própria thread e com um pool de processos
+    total, contacts = int(total), int(contacts)
+    processes = int(processes) or max(2, os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'repontuar.db')
+        conn, cursor = IAVendas.setup_database(path)
+        _fill_history(conn, total, contacts, 30, random.Random(20))
+        for label, workers in (('1 processo', 1), (f'{processes} processos', processes)):
+            IAVendas.clear_sentiment_cache()
+            # Regra nova para que parte das mensagens e dos contatos mude a cada execução
+            IAVendas.LEAD_SCORE_DELTAS['Negativo'] -= 5
+            stats = IAVendas.rescore_messages(conn, workers)
+            print(f"rescore [{label}]: {stats['mensagens']:,} mensagens de {stats['contatos']:,} contatos em "
+                  f"{stats['segundos']:.1f}s ({stats['mensagens_por_hora'] / 1e6:.1f} milhões/h) | "
+                  f"{stats['alteradas']:,} sentimentos e {stats['contatos_alterados']:,} contatos atualizados")
+        IAVendas.LEAD_SCORE_DELTAS['Negativo'] += 10
+        conn.close()
+    print(f"rescore: {os.cpu_count()} CPUs disponíveis")
+
+def _legacy_import(conn, cursor, rows):
+    # Caminho original: update_contact por linha (SELECT + INSERT/UPDATE + commit)
+    for name, industry, pain_point in rows:
+        cursor.execute('SELECT id FROM contacts WHERE name = ?', (name,))
+        if cursor.fetchone():
+            cursor.execute('UPDATE contacts SET industry = ?, pain_point = ? WHERE name = ?', (industry, pain_point, name))
+        else:
+            cursor.execute('INSERT INTO contacts (name, industry, pain_point) VALUES (?, ?, ?)', (name, industry, pain_point))
+        conn.commit()
+
+def bench_import(contacts=100_000, legacy=2000):
+    # Importação em massa de um CSV grande; a memória deve ficar constante (picos medidos com tracemalloc)
+    contacts, legacy = int(contacts), int(legacy)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'contatos.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('Nome;Indústria;Ponto de Dor\n')
+            f.writelines(f'Contato {i};{STAGES[i % 5]};dor {i % 97}\n' for i in range(contacts))
+        
+        conn, cursor = IAVendas.setup_database(os.path.join(tmp, 'legacy.db'))
+        rows = [(f'Contato {i}', 'varejo', 'dor') for i in range(legacy)]
+        baseline, _ = _timeit(_legacy_import, conn, cursor, rows)
+        conn.close()
+        
+        conn, cursor = IAVendas.setup_database(os.path.join(tmp, 'import.db'))
+        elapsed, stats = _timeit(IAVendas.import_contacts, conn, path)
+        again, restats = _timeit(IAVendas.import_contacts, conn, path)
+        
+        tracemalloc.start()
+        IAVendas.import_contacts(conn, path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        sample = [(f'Contato {i}', STAGES[i % 5], f'dor {i % 97}') for i in range(0, contacts, max(1, contacts // 1000))]
+        for row in sample:
+            IAVendas.update_contact(cursor, conn, *row)
+        changes = conn.total_changes
+        refresh, _ = _timeit(lambda: [IAVendas.update_contact(cursor, conn, *row) for row in sample])
+        idle_writes = conn.total_changes - changes
+        conn.close()
+    
+    print(f"import: {contacts:,} contatos em {elapsed:.2f}s ({contacts / elapsed:,.0f}/s; antes {legacy / baseline:,.0f}/s) | "
+          f"reimportação {again:.2f}s ({restats['gravados']} gravados) | pico de memória {peak / 1024:,.0f} KiB | "
+          f"refresh de {len(sample)} contatos sem mudança: {refresh * 1000:.1f} ms, {idle_writes} escritas")
+
+class _CrashingTransport(IAVendas.MockTransport):
+    # Simula a queda de uma sessão (Chrome travado, processo morto) depois de algumas leituras
+    def __init__(self, contact_names, crash_after, **options):
+        super().__init__(contact_names, **options)
+        self.crash_after = crash_after
+    
+    def fetch_new_messages(self, contact_name):
+        self.crash_after -= 1
+        if self.crash_after < 0:
+            os._exit(1)
+        return super().fetch_new_messages(contact_name)
+
+def _mock_session(worker_id, contact_names, crash_worker=None, crash_after=0):
+    # Latências de envio e leitura no lugar das esperas do navegador
+    options = {'send_latency': 0.02, 'fetch_wait': 0.01, 'reply_delay': (0.0, 0.01), 'seed': worker_id}
+    if worker_id == crash_worker:
+        return _CrashingTransport(contact_names, crash_after, **options)
+    return IAVendas.MockTransport(contact_names, **options)
+
+def bench_sharding(contacts=200, sessions=4, cycles=2):
+    # Vazão do modo supervisor com 1..N sessões sobre o mesmo banco, e redistribuição após uma queda
+    contacts, sessions, cycles = int(contacts), int(sessions), int(cycles)
+    IAVendas.SEND_PROFILE = 'rápido'
+    IAVendas.CONTACT_TIME_SLICE, IAVendas.IDLE_TIME_SLICE = 0.2, 0.01
+    rows = [(f'Contato {i}', 'varejo', 'falta de clientes') for i in range(contacts)]
+    
+    baseline = None
+    counts = sorted({1, *[n for n in (2, 4, 8, 16) if n < sessions], sessions})
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, summary = _timeit(IAVendas.run_supervisor, os.path.join(tmp, 'shard.db'), 'Ebook', count,
+                                           _mock_session, rows, cycles)
+        served = sum(stats['atendimentos'] for stats in summary['sessoes'])
+        baseline = baseline or served / elapsed
+        print(f"sharding: {count} sessões, {served} atendimentos em {elapsed:.1f}s ({served / elapsed:,.0f}/s) | "
+              f"{served / elapsed / baseline:.1f}x")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = functools.partial(_mock_session, crash_worker=0, crash_after=20)
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = IAVendas.run_supervisor(os.path.join(tmp, 'shard.db'), 'Ebook', sessions, factory, rows, cycles)
+    covered = sum(stats['contatos'] for stats in summary['sessoes'])
+    print(f"sharding: queda da sessão 0 -> {summary['redistribuidos']} contatos redistribuídos, "
+          f"{covered}/{contacts} contatos atendidos pelas {len(summary['sessoes'])} sessões restantes")
+
+def bench_dedup(total=200_000, contacts=1000, checks=100_000):
+    # Checagem de mensagem já vista: índice em memória vs. consulta ao banco por mensagem
+    total, contacts, checks = int(total), int(contacts), int(checks)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, cursor = IAVendas.setup_database(os.path.join(tmp, 'dedup.db'))
+        _fill_messages(conn, total, contacts, wa_ids=True)
+        warmup, _ = _timeit(IAVendas.seen_messages.load, cursor)
+        warmed = len(IAVendas.seen_messages)
+        
+        rng = random.Random(3)
+        probes = [(i % contacts + 1, f'wamid.{i}') for i in (rng.randrange(total) for _ in range(checks))]
+        memory, hits = _timeit(lambda: sum(IAVendas.seen_messages.seen(*probe) for probe in probes))
+        
+        def database_checks():
+            found = 0
+            for probe in probes:
+                cursor.execute('SELECT 1 FROM messages WHERE contact_id = ? AND wa_id = ?', probe)
+                found += cursor.fetchone() is not None
+            return found
+        database, found = _timeit(database_checks)
+        
+        # Textos repetidos com ids diferentes são mensagens distintas
+        stored = [IAVendas.log_message(cursor, conn, 1, 'ok', 'user', 'Neutro', wa_id) for wa_id in ('wamid.ok1', 'wamid.ok2', 'wamid.ok1')]
+        conn.close()
+    
+    _report('dedup', database, memory, checks)
+    print(f"dedup: aquecimento de {warmed:,} ids em {warmup * 1000:.0f} ms | "
+          f"acertos em memória {hits:,} de {found:,} no banco | 'ok' repetido gravado: {stored}")
+
+def _synthetic_png(width, height, seed, level=1):
+    # Tela parecida com a do WhatsApp: faixas de cor lisa com "texto" aleatório, comprimida como o Chrome (nível rápido)
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        color = bytes((230, 221, 212)) if (y // 40) % 2 else bytes((255, 255, 255))
+        row = bytearray(color * width)
+        if y % 40 < 14:
+            for x in range(rng.randrange(width // 4)):
+                offset = rng.randrange(width) * 3
+                row[offset:offset + 3] = b'\x30\x30\x30'
+        rows.append(b'\x00' + bytes(row))
+    
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (IAVendas.PNG_SIGNATURE + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b''.join(rows), level))
+            + chunk(b'IEND', b''))
+
+class _FakeDriver:
+    def __init__(self, screens):
+        self.screens = screens
+        self.calls = 0
+    
+    def get_screenshot_as_png(self):
+        self.calls += 1
+        return self.screens[self.calls % len(self.screens)]
+
+class _StallingFileHandler(logging.FileHandler):
+    # Disco que trava de vez em quando (flush lento, antivírus, rotação): `stall` segundos a cada `every` registros
+    def __init__(self, path, stall=0.02, every=200):
+        super().__init__(path, encoding='utf-8')
+        self.stall, self.every, self.count = stall, every, 0
+    
+    def emit(self, record):
+        self.count += 1
+        if self.count % self.every == 0:
+            time.sleep(self.stall)
+        super().emit(record)
+
+def _log_latencies(records):
+    latencies = []
+    for i in range(records):
+        start = time.perf_counter()
+        logging.info(f"Mensagem enviada para Contato {i}")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_logging(records=20_000, errors=2000):
+    # Latência de um logging.info no loop com um disco que trava: arquivo síncrono vs. fila + thread de gravação
+    records, errors = int(records), int(errors)
+    root = logging.getLogger()
+    with tempfile.TemporaryDirectory() as tmp:
+        IAVendas.stop_logging()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        sync_handler = _StallingFileHandler(os.path.join(tmp, 'sync.log'))
+        sync_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        root.addHandler(sync_handler)
+        baseline = _log_latencies(records)
+        root.removeHandler(sync_handler)
+        sync_handler.close()
+        
+        IAVendas.setup_logging(file_handler=_StallingFileHandler(os.path.join(tmp, 'queue.log')))
+        optimized = _log_latencies(records)
+        drain, _ = _timeit(IAVendas.stop_logging)
+        for name, latencies in (('antes', baseline), ('depois', optimized)):
+            print(f"logging {name}: {records:,} registros em {sum(latencies):.2f}s no loop | "
+                  f"p99 {_percentile(latencies, 0.99) * 1000:.3f} ms | máx. {max(latencies) * 1000:.1f} ms")
+        print(f"logging: fila esvaziada em {drain:.2f}s pela thread de gravação")
+        
+        # Rajada de falhas com o DOM quebrado: uma por segundo simulado, 3 telas distintas
+        clock = itertools.count()
+        manager = IAVendas.ScreenshotManager(os.path.join(tmp, 'capturas'), min_interval=60, max_files=20, keep_raw=5,
+                                             clock=lambda: next(clock))
+        driver = _FakeDriver([_synthetic_png(800, 600, seed) for seed in range(3)])
+        IAVendas.setup_logging(os.path.join(tmp, 'queue.log'))
+        for i in range(errors):
+            manager.capture(driver, ('read_messages', 'send_message')[i % 2], f'Contato {i}')
+        IAVendas.stop_logging()
+        files = os.listdir(manager.directory)
+        size = sum(os.path.getsize(os.path.join(manager.directory, name)) for name in files)
+        raw = len(driver.screens[0])
+        print(f"capturas: {errors} erros -> {driver.calls} telas tiradas, {len(files)} arquivos em disco "
+              f"({size / 1024:,.0f} KiB; antes {errors} arquivos, ~{errors * raw / 1024:,.0f} KiB) | "
+              f"PNG recomprimido: {len(IAVendas.recompress_png(driver.screens[0])) / raw:.0%} do original")
+    IAVendas.setup_logging()
+
+_IMPORT_TIMER = (
+    "import time; started = time.perf_counter(); import IAVendas{extra}; "
+    "print(time.perf_counter() - started)"
+)
+
+def _import_time(extra=''):
+    result = subprocess.run([sys.executable, '-c', _IMPORT_TIMER.format(extra=extra)], capture_output=True, text=True,
+                            cwd=tempfile.gettempdir(), env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    return float(result.stdout) if result.returncode == 0 else None
+
+def _legacy_startup(path):
+    # Inicialização antiga: todas as verificações de esquema a cada partida e os scripts apagados e reinseridos
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA user_version = 0')
+    conn.execute('DELETE FROM sales_scripts')
+    conn.commit()
+    conn.close()
+    conn, _ = IAVendas.setup_database(path)
+    conn.close()
+
+def _current_startup(path):
+    conn, _ = IAVendas.setup_database(path)
+    conn.close()
+
+def bench_startup(contacts=100_000, runs=5):
+    # Tempo até o bot estar pronto: importação do módulo e preparação do banco já existente
+    contacts, runs = int(contacts), int(runs)
+    lazy = min(filter(None, (_import_time() for _ in range(runs))), default=None)
+    eager = min(filter(None, (_import_time('; IAVendas._load_selenium()') for _ in range(runs))), default=None)
+    if lazy is not None and eager is not None:
+        print(f"startup: import IAVendas {lazy * 1000:.0f} ms | com Selenium {eager * 1000:.0f} ms "
+              f"(custo adiado até abrir o Chrome)")
+    else:
+        print("startup: Selenium não instalado; tempo de importação não comparado")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.db')
+        conn, cursor = IAVendas.setup_database(path)
+        now, now_ts = IAVendas.current_time()
+        cursor.executemany('INSERT INTO contacts (name, last_interaction, last_interaction_ts) VALUES (?, ?, ?)',
+                           ((f'Contato {i}', now, now_ts) for i in range(contacts)))
+        conn.commit()
+        conn.close()
+        baseline = min(_timeit(_legacy_startup, path)[0] for _ in range(runs))
+        
+        conn, cursor = IAVendas.setup_database(path)
+        cursor.execute("UPDATE sales_scripts SET success_count = 7, use_count = 9 WHERE stage = 'fechamento'")
+        conn.commit()
+        conn.close()
+        optimized = min(_timeit(_current_startup, path)[0] for _ in range(runs))
+        conn, cursor = IAVendas.setup_database(path)
+        cursor.execute("SELECT success_count, use_count FROM sales_scripts WHERE stage = 'fechamento'")
+        learned = cursor.fetchone()
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        conn.close()
+    
+    print(f"startup: banco com {contacts:,} contatos (versão {version}) pronto em {optimized * 1000:.1f} ms | "
+          f"antes {baseline * 1000:.1f} ms | {baseline / optimized:.1f}x | "
+          f"success_count/use_count aprendidos após reinício: {learned}")
+
+# Página local que imita o uso do WhatsApp Web: mensagens chegando o tempo todo, com fotos e fontes
+_BROWSER_PAGE = b"""<!doctype html><html><head><style>
+@font-face { font-family: Emoji; src: url('/font/emoji.woff2'); }
+body { font-family: Emoji, sans-serif; }
+</style></head><body><div id="main"></div><script>
+let n = 0;
+setInterval(() => {
+    const row = document.createElement('div');
+    row.innerHTML = '<span class="selectable-text">mensagem ' + n + '</span><img src="/img/' + n + '.png">';
+    document.getElementById('main').appendChild(row);
+    n++;
+}, 50);
+</script></body></html>"""
+
+def _browser_server():
+    import http.server
+    png = _synthetic_png(256, 256, 7)
+    
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/img/'):
+                body, kind = png, 'image/png'
+            elif self.path.startswith('/font/'):
+                body, kind = os.urandom(64 * 1024), 'font/woff2'
+            else:
+                body, kind = _BROWSER_PAGE, 'text/html'
+            self.send_response(200)
+            self.send_header('Content-Type', kind)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _browser_soak(url, mode, headless, duration, lifecycle_options=None):
+    def factory():
+        driver = IAVendas.create_driver(mode=mode, headless=headless)
+        driver.get(url)
+        return driver
+    
+    lifecycle = IAVendas.DriverLifecycle(factory, **(lifecycle_options or {'interval': float('inf')}))
+    lifecycle.start()
+    samples = []
+    try:
+        start = time.time()
+        while time.time() - start < duration:
+            time.sleep(5)
+            lifecycle.maybe_recycle()
+            usage = lifecycle.usage()
+            if usage is not None:
+                samples.append(usage)
+    finally:
+        lifecycle.close()
+    return samples, lifecycle.recycles
+
+def bench_browser(minutes=10, headless=1):
+    # Execução longa dos dois perfis de navegador contra a página local, medindo RSS e CPU do Chrome
+    duration, headless = float(minutes) * 60, bool(int(headless))
+    try:
+        IAVendas._load_selenium()
+    except ImportError:
+        print("browser: Selenium não instalado; benchmark não executado")
+        return
+    if IAVendas.process_tree_usage(os.getpid()) is None:
+        print("browser: sem /proc nem psutil para medir o navegador; benchmark não executado")
+        return
+    
+    server = _browser_server()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    # No perfil leve, o limite de RSS força reciclagens dentro da janela do teste
+    runs = [('completo', None),
+            ('leve', {'max_rss_mb': 400, 'interval': duration / 2, 'check_interval': 5})]
+    try:
+        for mode, options in runs:
+            try:
+                samples, recycles = _browser_soak(url, mode, headless, duration, options)
+            except Exception as e:
+                print(f"browser: não foi possível abrir o Chrome ({str(e).splitlines()[0]}); benchmark não executado")
+                return
+            if len(samples) < 2:
+                print(f"browser [{mode}]: amostras insuficientes")
+                continue
+            rss = [sample[0] / 2 ** 20 for sample in samples]
+            # A CPU acumulada zera a cada reciclagem; soma só os incrementos positivos
+            cpu = sum(max(0.0, b[1] - a[1]) for a, b in zip(samples, samples[1:]))
+            elapsed = 5 * (len(samples) - 1)
+            print(f"browser [{mode}]: RSS início {rss[0]:.0f} MB, fim {rss[-1]:.0f} MB, máx {max(rss):.0f} MB | "
+                  f"CPU média {100 * cpu / elapsed:.1f}% | reciclagens {recycles}")
+    finally:
+        server.shutdown()
+
+BENCHMARKS = {
+    'scripts': bench_scripts,
+    'sentiment': bench_sentiment,
+    'storage': bench_storage,
+    'scheduler': bench_scheduler,
+    'pipeline': bench_pipeline,
+    'outbox': bench_outbox,
+    'import': bench_import,
+    'sharding': bench_sharding,
+    'dedup': bench_dedup,
+    'archive': bench_archive,
+    'rescore': bench_rescore,
+    'logging': bench_logging,
+    'startup': bench_startup,
+    'browser': bench_browser,
+}
+
+if __name__ == "__main__":
+    # Uso: python benchmarks.py [nome[=argumento]] ...  (ex.: storage=100000)
+    for spec in sys.argv[1:] or list(BENCHMARKS):
+        name, _, arg = spec.partition('=')
+        BENCHMARKS[name](*([arg] if arg else []))